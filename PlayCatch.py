@@ -1,13 +1,14 @@
-import json
+import argparse
+
 import numpy as np
-from keras.models import Sequential
-from keras.layers.core import Dense
-from keras.optimizers import sgd
+
+from qtrain import TrainConfig, DQNAgent, Trainer
 
 
 class Catch(object):
-    def __init__(self, grid_size=10):
+    def __init__(self, grid_size=10, seed=None):
         self.grid_size = grid_size
+        self.rng = np.random.RandomState(seed)
         self.reset()
 
     def _update_state(self, action):
@@ -66,105 +67,57 @@ class Catch(object):
         return self.observe(), reward, game_over
 
     def reset(self):
-        n = np.random.randint(0, self.grid_size-1, size=1)
-        m = np.random.randint(1, self.grid_size-2, size=1)
+        n = self.rng.randint(0, self.grid_size-1)
+        m = self.rng.randint(1, self.grid_size-2)
         self.state = np.asarray([0, n, m])[np.newaxis]
 
 
-class ExperienceReplay(object):
-    def __init__(self, max_memory=100, discount=.9):
-        self.max_memory = max_memory
-        self.memory = list()
-        self.discount = discount
-
-    def remember(self, states, game_over):
-        # memory[i] = [[state_t, action_t, reward_t, state_t+1], game_over?]
-        self.memory.append([states, game_over])
-        if len(self.memory) > self.max_memory:
-            del self.memory[0]
-
-    def get_batch(self, model, batch_size=10):
-        len_memory = len(self.memory)
-        num_actions = model.output_shape[-1]
-        env_dim = self.memory[0][0][0].shape[1]
-        inputs = np.zeros((min(len_memory, batch_size), env_dim))
-        targets = np.zeros((inputs.shape[0], num_actions))
-        for i, idx in enumerate(np.random.randint(0, len_memory,
-                                                  size=inputs.shape[0])):
-            state_t, action_t, reward_t, state_tp1 = self.memory[idx][0]
-            game_over = self.memory[idx][1]
-
-            inputs[i:i+1] = state_t
-            # There should be no target values for actions not taken.
-            # Thou shalt not correct actions not taken #deep
-            targets[i] = model.predict(state_t)[0]
-            Q_sa = np.max(model.predict(state_tp1)[0])
-            if game_over:  # if game_over is True
-                targets[i, action_t] = reward_t
-            else:
-                # reward_t + gamma * max_a' Q(s', a')
-                targets[i, action_t] = reward_t + self.discount * Q_sa
-        return inputs, targets
-
-
-if __name__ == "__main__":
-    # parameters
-    epsilon = .1  # exploration
-    num_actions = 3  # [move_left, stay, move_right]
-    epoch = 1000
-    max_memory = 500
-    hidden_size = 100
-    batch_size = 50
-    grid_size = 10
-
-    model = Sequential()
-    model.add(Dense(hidden_size, input_shape=(grid_size**2,), activation='relu'))
-    model.add(Dense(hidden_size, activation='relu'))
-    model.add(Dense(num_actions))
-    model.compile(sgd(lr=.2), "mse")
+def train(config, callback=None):
+    """Train on Catch with a grid of config.width x config.height, width is used as the grid size"""
+    agent = DQNAgent(config)
+    env = Catch(config.width, seed=config.seed)
 
-    # If you want to continue training from a previous model, just uncomment the line bellow
-    # model.load_weights("model.h5")
-
-    # Define environment/game
-    env = Catch(grid_size)
-
-    # Initialize experience replay object
-    exp_replay = ExperienceReplay(max_memory=max_memory)
-
-    # Train
-    win_cnt = 0
-    for e in range(epoch):
-        loss = 0.
+    def run_episode(e, seed):
+        # seeded per episode, so a resumed run plays the same fruit as an uninterrupted one
+        if seed is not None:
+            env.rng = np.random.RandomState(seed)
         env.reset()
         game_over = False
         # get initial input
         input_t = env.observe()
+        reward = 0
 
         while not game_over:
             input_tm1 = input_t
             # get next action
-            if np.random.rand() <= epsilon:
-                action = np.random.randint(0, num_actions, size=1)
-            else:
-                q = model.predict(input_tm1)
-                action = np.argmax(q[0])
+            action = agent.act(input_tm1)
 
             # apply action, get rewards and new state
             input_t, reward, game_over = env.act(action)
-            if reward == 1:
-                win_cnt += 1
 
-            # store experience
-            exp_replay.remember([input_tm1, action, reward, input_t], game_over)
+            # store experience and adapt model
+            agent.observe(input_tm1, action, reward, input_t, game_over)
+        return {"score": int(reward == 1)}
 
-            # adapt model
-            inputs, targets = exp_replay.get_batch(model, batch_size=batch_size)
+    return Trainer(config, [agent], run_episode, callback).run()
 
-            loss += model.train_on_batch(inputs, targets)
-        print("Epoch {:03d}/999 | Loss {:.4f} | Win count {}".format(e, loss, win_cnt))
 
-    # Save trained model weights and architecture, this will be used by the visualization code
-    model.save_weights("model.h5", overwrite=True)
-    with open("model.json", "w") as outfile:
-        json.dump(model.to_json(), outfile)
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train a DQN Catch player")
+    parser.add_argument("--resume", action="store_true", help="carry on training the model.h5 of an earlier run")
+    args = parser.parse_args()
+
+    # parameters
+    grid_size = 10
+    config = TrainConfig(epsilon=.1,
+                         epoch=1000,
+                         max_memory=500,
+                         batch_size=50,
+                         architecture={"type": "mlp", "hidden": [100, 100], "init": "glorot_uniform"},
+                         width=grid_size,
+                         height=grid_size,
+                         seed=None,
+                         weights_file="model.h5",
+                         resume_weights=args.resume)
+
+    train(config)
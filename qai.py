@@ -0,0 +1,102 @@
+from qgame import LogPlayer, Player, PlayerActions
+from qraster import mirror
+
+
+class AIPlayer(Player):
+    """Player driven by a qtrain.DQNAgent looking at the shared visual memory.
+
+    Rewards are +1 for scoring after the ball has been hit and -1 for conceding,
+    games with different rules override reward() and scored().
+    """
+
+    def __init__(self, playerNum, agent):
+        super().__init__(playerNum)
+        self.agent = agent
+        self.scored_this_frame = 0
+        self.last_state = None
+        self.last_action = None
+
+    def set_game(self, game):
+        super().set_game(game)
+        self.last_state = None
+        self.last_action = None
+
+    def reward(self):
+        reward = self.scored_this_frame
+        self.scored_this_frame = 0
+        return reward
+
+    def event_step(self, time_passed, delta_mult):
+        memory = self.game.shared_visual_memory
+        state = memory[memory.frame_index()]
+
+        # we need a few frames to get some visual history
+        if memory.frame_index() <= 1:
+            action = PlayerActions.stay.value + 1
+        else:
+            action = self.agent.act(state)
+
+        if self.last_state is not None:
+            # store experience and adapt the model
+            self.agent.observe(self.last_state, self.last_action, self.reward(), state, self.game.game_over_flag)
+
+        self.last_state = state
+        self.last_action = action
+        super().perform_action(PlayerActions(action - 1))
+        super().event_step(time_passed, delta_mult)
+
+    def scored(self, me=True):
+        super().scored(me)
+
+        if me:
+            # no gain if we nobody was involved
+            if self.game.bounce_count == 0:
+                return
+            self.scored_this_frame = 1
+        else:
+            self.scored_this_frame = -1
+
+
+class SquashScoring:
+    """Squash rules for a Player, conceding costs a point and every hit is worth 5"""
+
+    def scored(self, me=True):
+        # single player game, i can only lose points :(
+        self.score -= 1
+
+    def collide_with_ball(self):
+        self.score += 5
+
+
+class SquashAIPlayer(SquashScoring, AIPlayer):
+    def reward(self):
+        self.scored_this_frame = 0
+        return self.score / 10
+
+    def scored(self, me=True):
+        super().scored(me)
+        self.scored_this_frame = -1
+
+
+class SquashLogPlayer(SquashScoring, LogPlayer):
+    """Plays back a recorded SquashAIPlayer, scoring like it did so the replay fingerprints the same"""
+
+
+class PolicyPlayer(Player):
+    """Frozen opponent acting greedily from a qpolicy.NumpyPolicy, e.g. a league snapshot.
+
+    Policies are trained as the right hand player, as player 1 the screen is mirrored.
+    """
+
+    def __init__(self, playerNum, policy):
+        super().__init__(playerNum)
+        self.policy = policy
+
+    def event_step(self, time_passed, delta_mult):
+        memory = self.game.shared_visual_memory
+        state = memory[memory.frame_index()]
+        if self.playerNum == 1:
+            state = mirror(state, self.game.width, self.game.height)
+        action = self.policy.act(state)
+        super().perform_action(PlayerActions(action - 1))
+        super().event_step(time_passed, delta_mult)
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""Benchmarks, run with python3 qbench.py [name ...], no names runs them all"""
+import sys
+import time
+
+import numpy as np
+
+BENCHMARKS = dict()
+
+
+def benchmark(fn):
+    BENCHMARKS[fn.__name__] = fn
+    return fn
+
+
+def timeit(fn, repeat=100, warmup=3):
+    """Median seconds per call"""
+    for _ in range(warmup):
+        fn()
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def print_table(headers, rows):
+    widths = [max(len(str(v)) for v in column) for column in zip(headers, *rows)]
+    for row in [headers] + rows:
+        print("  ".join(str(v).rjust(w) for v, w in zip(row, widths)))
+
+
+@benchmark
+def models(width=80, height=60, batch_sizes=(20, 50)):
+    """Parameter count, single row inference latency and training step time per architecture"""
+    from qmodels import ARCHITECTURES, build_model
+
+    rows = list()
+    for name in sorted(ARCHITECTURES):
+        model = build_model(name, width, height)
+        observation = np.random.rand(1, width * height).astype(np.float32)
+        row = [name, model.count_params(),
+               "{:.3f}".format(timeit(lambda: model.predict(observation)) * 1000)]
+        for batch_size in batch_sizes:
+            inputs = np.random.rand(batch_size, width * height).astype(np.float32)
+            targets = np.random.rand(batch_size, model.output_shape[-1]).astype(np.float32)
+            row.append("{:.3f}".format(timeit(lambda: model.train_on_batch(inputs, targets)) * 1000))
+        rows.append(row)
+
+    print_table(["model", "params", "predict ms"] + ["train ms b{}".format(b) for b in batch_sizes], rows)
+
+
+@benchmark
+def backends(architectures=("mlp50", "mlp100"), width=80, height=60, batch_sizes=(20, 50)):
+    """train_on_batch updates per second, Keras against qmlp.NumpyMLP, on game frames and on dense noise"""
+    from qmodels import build_model
+    from qquant import record_frames
+
+    frames = record_frames(width, height, games=2)
+    rng = np.random.RandomState(0)
+    rows = list()
+    for backend in ("keras", "numpy"):
+        for architecture in architectures:
+            try:
+                model = build_model(architecture, width, height, backend=backend)
+            except ImportError as e:
+                rows.append([backend, architecture, "-", "unavailable: {}".format(e), "-"])
+                continue
+            for batch_size in batch_sizes:
+                targets = rng.rand(batch_size, 3).astype(np.float32)
+                batch = frames[rng.randint(len(frames), size=batch_size)]
+                noise = rng.rand(batch_size, width * height).astype(np.float32)
+                rows.append([backend, architecture, batch_size] +
+                            ["{:.0f}".format(1 / timeit(lambda: model.train_on_batch(inputs, targets)))
+                             for inputs in (batch, noise)])
+
+    print_table(["backend", "model", "batch", "updates/s frames", "updates/s dense"], rows)
+
+
+def _play_scripted(sim_class, seed, fast):
+    from qopponent import TrackingController
+
+    sim = sim_class(seed=seed)
+    controllers = [TrackingController(seed=seed + n) for n in range(sim.num_players)]
+    while not sim.game_over_flag:
+        paddles = [p.moved(sim.height) for p in sim.players]
+        actions = [c.decide(sim.ball, p, p.hit_direction, sim.height) for c, p in zip(controllers, paddles)]
+        if fast:
+            sim.fast_forward(actions, min(c.hold_frames(p) for c, p in zip(controllers, paddles)))
+        else:
+            sim.step(*actions)
+    return sim.frame_count, [p.score for p in sim.players]
+
+
+@benchmark
+def fast_forward(games=200):
+    """Scripted vs scripted games stepped every frame and fast forwarded between events"""
+    from qsim import PongSim, SquashSim
+
+    rows = list()
+    for sim_class in (PongSim, SquashSim):
+        results = dict()
+        for fast in (False, True):
+            start = time.perf_counter()
+            results[fast] = [_play_scripted(sim_class, seed, fast) for seed in range(games)]
+            elapsed = time.perf_counter() - start
+            frames = sum(r[0] for r in results[fast])
+            rows.append([sim_class.__name__, "fast forward" if fast else "every frame",
+                         frames, "{:.0f}".format(frames / elapsed)])
+        rows[-1].append("match" if results[False] == results[True] else "MISMATCH")
+
+    print_table(["game", "mode", "frames", "frames/s", "result"], [r + [""] * (5 - len(r)) for r in rows])
+
+
+def _inference_client(socket_path, observation, requests, latencies):
+    from qserve import InferenceClient
+
+    client = InferenceClient(socket_path)
+    for _ in range(requests):
+        client.request(observation)
+    latencies.extend(client.latencies)
+    client.close()
+
+
+@benchmark
+def inference_server(clients=(1, 8, 32), requests=500, architecture="mlp100", width=80, height=60):
+    """Round trip latency and server side batching with many game processes asking for actions"""
+    import multiprocessing
+    import os
+    import tempfile
+    import threading
+
+    from qmodels import get_architecture
+    from qpolicy import save_weights
+    from qserve import InferenceServer
+
+    directory = tempfile.mkdtemp()
+    weights_file = os.path.join(directory, "weights.npz")
+    sizes = [width * height] + get_architecture(architecture)["hidden"] + [3]
+    save_weights(weights_file, [w for a, b in zip(sizes[:-1], sizes[1:])
+                                for w in (np.random.uniform(-.05, .05, (a, b)), np.zeros(b))])
+    observation = np.random.rand(1, width * height).astype(np.float32)
+
+    rows = list()
+    for count in clients:
+        socket_path = os.path.join(directory, "bench.sock")
+        server = InferenceServer(socket_path, weights_file, architecture)
+        thread = threading.Thread(target=server.serve_forever, kwargs={"stats_interval": 0}, daemon=True)
+        thread.start()
+        while not os.path.exists(socket_path):
+            time.sleep(.01)
+
+        manager = multiprocessing.Manager()
+        latencies = manager.list()
+        start = time.perf_counter()
+        processes = [multiprocessing.Process(target=_inference_client,
+                                             args=(socket_path, observation, requests, latencies))
+                     for _ in range(count)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+        server.stop()
+        thread.join()
+
+        stats = server.stats()
+        rows.append([count, "{:.0f}".format(count * requests / elapsed),
+                     "{:.3f}".format(np.percentile(list(latencies), 50) * 1000),
+                     "{:.3f}".format(np.percentile(list(latencies), 99) * 1000),
+                     "{:.1f}".format(stats["mean_batch"]), stats["max_batch"]])
+
+    print_table(["clients", "requests/s", "rtt p50 ms", "rtt p99 ms", "mean batch", "max batch"], rows)
+
+
+@benchmark
+def n_step(target=.8, window=50, max_epochs=3000, seeds=(0, 1, 2)):
+    """Catch frames needed to reach a rolling mean score, one step vs n-step and Double DQN targets"""
+    from PlayCatch import train
+    from qtrain import TrainConfig
+
+    settings = [("1 step", {}),
+                ("3 step", {"n_step": 3}),
+                ("1 step double", {"double_dqn": True, "target_update": 100}),
+                ("3 step double", {"n_step": 3, "double_dqn": True, "target_update": 100})]
+    rows = list()
+    for name, overrides in settings:
+        frames = list()
+        for seed in seeds:
+            config = TrainConfig(epsilon=.1, epoch=max_epochs, max_memory=500, batch_size=50, width=10, height=10,
+                                 architecture={"type": "mlp", "hidden": [100, 100], "init": "glorot_uniform"},
+                                 seed=seed, verbose=False, **overrides)
+            scores = list()
+
+            def reached():
+                return len(scores) >= window and np.mean(scores[-window:]) >= target
+
+            train(config, callback=lambda stats: scores.append(stats["score"]) or reached())
+            # every Catch episode is grid size - 1 frames
+            frames.append(len(scores) * (config.width - 1) if reached() else None)
+        done = [f for f in frames if f is not None]
+        rows.append([name, "{}/{}".format(len(done), len(seeds)),
+                     "{:.0f}".format(np.mean(done)) if done else "-"])
+
+    print_table(["targets", "reached", "mean frames"], rows)
+
+
+@benchmark
+def resolution(sizes=((40, 30), (80, 60), (160, 120)), epochs=200, eval_size=(80, 60), eval_episodes=20,
+               backend="numpy"):
+    """Headless Pong training frames/s and score per resolution, every model is also
+    evaluated playing at eval_size through a resampler"""
+    import os
+    import tempfile
+
+    from qenv import PongEnv, evaluate, train
+    from qmodels import build_model
+    from qtrain import TrainConfig
+
+    directory = tempfile.mkdtemp()
+    rows = list()
+    for width, height in sizes:
+        weights_file = os.path.join(directory, "{}x{}.h5".format(width, height))
+        config = TrainConfig(epoch=epochs, width=width, height=height, seed=0, verbose=False,
+                             weights_file=weights_file, backend=backend)
+        start = time.perf_counter()
+        history = train(config)
+        elapsed = time.perf_counter() - start
+        frames = sum(stats["frames"] for stats in history)
+
+        model = build_model(config.architecture, width, height, backend=backend)
+        model.load_weights(weights_file)
+        env = PongEnv(eval_size[0], eval_size[1], observation_size=(width, height))
+        rows.append(["{}x{}".format(width, height), frames, "{:.0f}".format(frames / elapsed),
+                     "{:.3f}".format(np.mean([stats["score"] for stats in history[-epochs // 4:]])),
+                     "{:.3f}".format(evaluate(model, env, eval_episodes))])
+
+    print_table(["resolution", "frames", "frames/s", "train score", "score at {}x{}".format(*eval_size)], rows)
+
+
+def _random_actions(env, steps, seed=0):
+    rng = np.random.RandomState(seed)
+    return rng.randint(env.action_space.n, size=(steps, getattr(env, "num_envs", 1)))
+
+
+@benchmark
+def vector_env(counts=(1, 2, 4, 8), steps=2000, width=80, height=60):
+    """Environment steps per second, one env in process against M env processes in lockstep"""
+    import functools
+
+    from qenv import PongEnv, SubprocVectorEnv
+
+    env = PongEnv(width, height, seed=0)
+    env.reset()
+    actions = _random_actions(env, steps)
+    start = time.perf_counter()
+    for action in actions:
+        if env.step(action[0])[2]:
+            env.reset()
+    single = steps / (time.perf_counter() - start)
+    rows = [["in process", 1, "{:.0f}".format(single), "1.00"]]
+
+    for count in counts:
+        with SubprocVectorEnv([functools.partial(PongEnv, width, height, seed=n * 1000) for n in range(count)]) as envs:
+            envs.reset()
+            actions = _random_actions(envs, steps)
+            start = time.perf_counter()
+            for action in actions:
+                envs.step(action)
+            rate = count * steps / (time.perf_counter() - start)
+        rows.append(["subprocess", count, "{:.0f}".format(rate), "{:.2f}".format(rate / single)])
+
+    print_table(["mode", "envs", "steps/s", "speedup"], rows)
+
+
+def _random_mlp_weights(architecture, width, height, rng, num_actions=3):
+    """He initialised weights in model.get_weights() order, a stand in for a trained file"""
+    from qmodels import get_architecture
+
+    config = get_architecture(architecture)
+    sizes = [width * height] + config["hidden"]
+    weights = list()
+    for inputs, outputs in zip(sizes[:-1], sizes[1:]):
+        weights += [rng.randn(inputs, outputs).astype(np.float32) * np.sqrt(2 / inputs),
+                    np.full(outputs, .01, dtype=np.float32)]
+    for outputs in ([1, num_actions] if config.get("dueling", False) else [num_actions]):
+        weights += [rng.randn(sizes[-1], outputs).astype(np.float32) * np.sqrt(1 / sizes[-1]),
+                    np.zeros(outputs, dtype=np.float32)]
+    return weights
+
+
+@benchmark
+def quantized(architectures=("mlp50", "mlp100", "mlp50_dueling"), width=80, height=60, games=5):
+    """int8 against float32 memory, latency and agreement on frames from scripted games, int8 only saves memory"""
+    from qpolicy import NumpyPolicy
+    from qquant import QuantizedPolicy, agreement, compare, record_frames
+
+    frames = record_frames(width, height, games=games)
+    rng = np.random.RandomState(0)
+    rows = list()
+    for architecture in architectures:
+        weights = _random_mlp_weights(architecture, width, height, rng)
+        float_policy = NumpyPolicy(weights, architecture)
+        quantized_policy = QuantizedPolicy.from_weights(weights, architecture)
+        agreed = "{:.4f}".format(agreement(float_policy, quantized_policy, frames))
+        rows.extend([architecture] + row + [agreed] for row in compare(float_policy, quantized_policy, frames))
+    print_table(["architecture", "weights", "memory kB", "act us", "batch 32 us", "agreement"], rows)
+
+
+@benchmark
+def learners(counts=(1, 2, 4), steps=100, batch_size=32, architecture="mlp50", width=80, height=60):
+    """Data-parallel learner scaling, efficiency is samples/s against counts[0] learners times the speedup"""
+    import os
+
+    from qenv import PongEnv
+    from qlearners import DataParallelLearners
+    from qreplay import ReplayShard
+    from qtrain import TrainConfig
+
+    config = TrainConfig(architecture=architecture, backend="numpy", batch_size=batch_size, width=width,
+                         height=height, seed=0, verbose=False)
+    # benchmark segments belong to nobody else, one left by an interrupted run is replaced
+    replay = ReplayShard("qbench_replay", 0, capacity=5000, observation_size=width * height, replace=True)
+    rows = list()
+    base = None
+    try:
+        env = PongEnv(width, height, seed=0)
+        state = env.reset()
+        for action in _random_actions(env, replay.capacity)[:, 0]:
+            next_state, reward, done, info = env.step(action)
+            replay.remember(state, action, reward, next_state, done, info.get("truncated", False))
+            state = env.reset() if done else next_state
+
+        for count in counts:
+            with DataParallelLearners("qbench_learners", config, "qbench_replay", 1, count,
+                                      replace=True) as parallel:
+                parallel.train(5)
+                start = time.perf_counter()
+                parallel.train(steps)
+                rate = steps * count * batch_size / (time.perf_counter() - start)
+            base = base or rate / count
+            rows.append([count, "{:.1f}".format(rate / count / batch_size), "{:.0f}".format(rate),
+                         "{:.2f}".format(rate / (count * base))])
+    finally:
+        replay.close()
+
+    print("{} cpus, OMP_NUM_THREADS={}".format(os.cpu_count(), os.environ.get("OMP_NUM_THREADS", "unset")))
+    print_table(["learners", "updates/s", "samples/s", "efficiency"], rows)
+
+
+@benchmark
+def exploration(games=8, steps=500, architecture="mlp100", width=80, height=60):
+    """Share of rows sent through the network and action selection time, predicting all rows or exploring first"""
+    from qenv import PongEnv
+    from qtrain import DQNAgent, TrainConfig, act_batch
+
+    schedules = [("constant", {"epsilon": .2}),
+                 ("annealed", {"epsilon": 1., "epsilon_final": .1, "epsilon_steps": steps}),
+                 ("ape-x", {"epsilon": .4, "epsilon_alpha": 7})]
+    rows = list()
+    for name, settings in schedules:
+        config = TrainConfig(architecture=architecture, backend="numpy", width=width, height=height, seed=0,
+                             **settings)
+        model = DQNAgent(config).model
+        envs = [PongEnv(width, height, seed=n) for n in range(games)]
+        states = [env.reset()[np.newaxis] for env in envs]
+        timings = {"predict all": 0., "explore first": 0.}
+        for mode in timings:
+            agents = [DQNAgent(config, model, seed=n, actor=n, num_actors=games) for n in range(games)]
+            for _ in range(steps):
+                start = time.perf_counter()
+                if mode == "predict all":
+                    q = model.predict(np.vstack(states))
+                    actions = [agent.explore() for agent in agents]
+                    actions = [int(np.argmax(q[n])) if action is None else action for n, action in enumerate(actions)]
+                else:
+                    actions = act_batch(agents, states)
+                timings[mode] += time.perf_counter() - start
+                for n, (env, agent, action) in enumerate(zip(envs, agents, actions)):
+                    agent.steps += 1
+                    state, _, done, _ = env.step(action)
+                    states[n] = (env.reset() if done else state)[np.newaxis]
+        inferred = sum(agent.inferred for agent in agents)
+        rows.append([name, "{:.1%}".format(inferred / (games * steps)),
+                     "{:.1f}".format(timings["predict all"] / steps * 1e6),
+                     "{:.1f}".format(timings["explore first"] / steps * 1e6)])
+
+    print_table(["schedule", "rows inferred", "predict all us", "explore first us"], rows)
+
+
+HEAVY_MODULES = ("keras", "tensorflow", "theano", "sge", "pygame")
+# modules that must import with the standard library and NumPy only
+LIGHT_MODULES = ("qsim", "qraster", "qopponent", "qtrain", "qpolicy", "qcheckpoint", "qleague", "qserve",
+                 "qsweep", "qrecord", "qenv", "qshm", "qreplay", "qgeometry", "qview", "qquant", "qmlp", "qmemory",
+                 "qlearners", "qexplore", "qpong_ai", "qsquash_ai", "PlayCatch")
+
+
+@benchmark
+def startup(modules=LIGHT_MODULES + ("qgame",), repeat=3):
+    """Fresh interpreter import time per module and which heavy dependencies it drags in"""
+    import subprocess
+
+    code = ("import sys, time; start = time.perf_counter(); import {}; "
+            "print(time.perf_counter() - start); print(','.join(m for m in {!r} if m in sys.modules))")
+    rows = list()
+    for module in modules:
+        times = list()
+        heavy = ""
+        for _ in range(repeat):
+            result = subprocess.run([sys.executable, "-c", code.format(module, HEAVY_MODULES)],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            if result.returncode != 0:
+                heavy = "import failed: " + result.stderr.strip().splitlines()[-1]
+                break
+            elapsed, heavy = result.stdout.splitlines()
+            times.append(float(elapsed))
+        status = "ok"
+        if module in LIGHT_MODULES and heavy:
+            status = "REGRESSION"
+        rows.append([module, "{:.1f}".format(np.median(times) * 1000) if times else "-", heavy or "-", status])
+
+    print_table(["module", "import ms", "heavy imports", "status"], rows)
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(BENCHMARKS)
+    for name in names:
+        print("== {} ==".format(name))
+        BENCHMARKS[name]()
@@ -0,0 +1,118 @@
+import glob
+import os
+import pickle
+import threading
+from os import path
+
+
+class Checkpoint:
+    def __init__(self, epoch, weights, optimizer_weights, state):
+        self.epoch = epoch
+        self.weights = weights
+        self.optimizer_weights = optimizer_weights
+        self.state = state
+
+    def restore_model(self, model):
+        model.set_weights(self.weights)
+        if self.optimizer_weights:
+            # keras only creates the optimizer variables when the train function is built
+            if hasattr(model, "_make_train_function"):
+                model._make_train_function()
+            model.optimizer.set_weights(self.optimizer_weights)
+
+
+class Checkpointer:
+    """Writes training checkpoints from a background thread.
+
+    save() copies the model and optimizer weights on the calling thread and hands
+    them to the writer, so the game loop never waits on the disk. If a write is
+    still running when the next save comes in only the newest pending checkpoint
+    is kept. Files are written under a temporary name and renamed into place, a
+    crash mid write never leaves a broken checkpoint behind.
+    """
+
+    def __init__(self, directory, keep=3, prefix="ckpt"):
+        self.directory = directory
+        self.keep = keep
+        self.prefix = prefix
+        self.pending = None
+        self.writing = False
+        self.closed = False
+        self.error = None
+        self.cond = threading.Condition()
+        os.makedirs(directory, exist_ok=True)
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+
+    def filename(self, epoch):
+        return path.join(self.directory, "{}_{:06d}.pkl".format(self.prefix, epoch))
+
+    def save(self, epoch, model, state):
+        """state is pickled as is, pass copies of anything that keeps changing
+        (replay memory, rng states, counters)
+        """
+        if self.error is not None:
+            raise self.error
+        checkpoint = Checkpoint(epoch, model.get_weights(), model.optimizer.get_weights(), state)
+        with self.cond:
+            self.pending = checkpoint
+            self.cond.notify_all()
+
+    def wait(self):
+        """Block until everything queued so far is on disk"""
+        with self.cond:
+            while self.pending is not None or self.writing:
+                self.cond.wait()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.wait()
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join()
+
+    def checkpoints(self):
+        return sorted(glob.glob(path.join(self.directory, "{}_*.pkl".format(self.prefix))))
+
+    def load_latest(self):
+        files = self.checkpoints()
+        if not files:
+            return None
+        return load(files[-1])
+
+    def _writer(self):
+        while True:
+            with self.cond:
+                while self.pending is None and not self.closed:
+                    self.cond.wait()
+                if self.pending is None:
+                    return
+                checkpoint = self.pending
+                self.pending = None
+                self.writing = True
+            try:
+                self._write(checkpoint)
+            except Exception as e:
+                self.error = e
+            with self.cond:
+                self.writing = False
+                self.cond.notify_all()
+
+    def _write(self, checkpoint):
+        filename = self.filename(checkpoint.epoch)
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "wb") as outfile:
+            pickle.dump(checkpoint, outfile, pickle.HIGHEST_PROTOCOL)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(tmp_filename, filename)
+
+        for old in self.checkpoints()[:-self.keep]:
+            os.remove(old)
+
+
+def load(filename):
+    with open(filename, "rb") as infile:
+        return pickle.load(infile)
@@ -0,0 +1,449 @@
+"""Gym style reset()/step(action) environments for Pong, Squash and Catch.
+
+The games are the headless qsim and PlayCatch rules, observations are the flattened
+float32 screen and actions are indices 0-2 (up, stay, down) like DQNAgent.act returns.
+When gym is installed the environments are gym.Env subclasses with gym spaces,
+otherwise Discrete and Box below stand in with the same attributes.
+
+SubprocVectorEnv steps M environments in their own processes in lockstep, the
+observations, rewards and done flags come back through shared memory so only
+the actions and info dicts go through the pipes.
+"""
+import ctypes
+import multiprocessing
+
+import numpy as np
+
+from PlayCatch import Catch
+from qopponent import TrackingController
+from qraster import Resampler, mirror
+from qsim import PongSim, SquashSim
+from qtrain import DQNAgent, Trainer, act_batch
+from qview import FrameBroadcaster
+
+try:
+    import gym
+    from gym.spaces import Box, Discrete
+    _Env = gym.Env
+except ImportError:
+    gym = None
+    _Env = object
+
+    class Discrete:
+        def __init__(self, n):
+            self.n = n
+            self.shape = ()
+            self.dtype = np.int64
+            self.np_random = np.random.RandomState()
+
+        def sample(self):
+            return int(self.np_random.randint(self.n))
+
+        def contains(self, x):
+            return 0 <= int(x) < self.n
+
+    class Box:
+        def __init__(self, low, high, shape, dtype=np.float32):
+            self.low = np.full(shape, low, dtype=dtype)
+            self.high = np.full(shape, high, dtype=dtype)
+            self.shape = tuple(shape)
+            self.dtype = dtype
+
+        def contains(self, x):
+            x = np.asarray(x)
+            return x.shape == self.shape and bool(np.all(x >= self.low) and np.all(x <= self.high))
+
+
+def default_opponent(seed=None):
+    """The scripted opponent qpong_ai trains against"""
+    return TrackingController(reaction_delay=6, speed=.6, error=4, seed=seed)
+
+
+class PongEnv(_Env):
+    """Pong as the right hand player against a scripted or frozen opponent.
+
+    opponent is either a qopponent.TrackingController or anything with act(observation),
+    such as a qpolicy.NumpyPolicy league snapshot, which sees the screen mirrored.
+    observation_size (width, height) resamples the screen to a model's input size,
+    so the game can be played at a different resolution than the model was trained at.
+    Rewards are the same as qai.AIPlayer, +1 for scoring after the ball has been hit
+    and -1 for conceding. Episodes end with the game or after max_frames.
+    """
+
+    metadata = {"render.modes": []}
+    reward_range = (-1, 1)
+
+    def __init__(self, width=80, height=60, seed=None, opponent=None, max_frames=10000, observation_size=None):
+        self.width = width
+        self.height = height
+        self.max_frames = max_frames
+        self.opponent = opponent if opponent is not None else self.make_opponent(seed)
+        self.sim = self.make_sim(seed)
+        observation_size = observation_size or (width, height)
+        self.resampler = Resampler(width, height, *observation_size)
+        self.observation_space = Box(0., 1., (observation_size[0] * observation_size[1],), dtype=np.float32)
+        self.action_space = Discrete(3)
+        self.episode_seed = seed
+
+    def make_sim(self, seed):
+        return PongSim(self.width, self.height, seed=seed)
+
+    def make_opponent(self, seed):
+        return default_opponent(seed)
+
+    def seed(self, seed=None):
+        self.episode_seed = seed
+        return [seed]
+
+    def reset(self):
+        """Start a new game, a seeded environment plays seed, seed + 1, ... on each reset"""
+        self.sim.reset(self.episode_seed)
+        if self.episode_seed is not None:
+            self.episode_seed += 1
+        if self.opponent is not None and hasattr(self.opponent, "reset"):
+            self.opponent.reset()
+        return self.observe()
+
+    def observe(self):
+        return self.resampler(self.sim.observe().astype(np.float32))[0]
+
+    def opponent_action(self):
+        sim = self.sim
+        if hasattr(self.opponent, "decide"):
+            return self.opponent.decide(sim.ball, sim.player1.moved(sim.height), sim.player1.hit_direction,
+                                        sim.height)
+        return self.opponent.act(self.resampler(mirror(sim.observe(), self.width, self.height))) - 1
+
+    def step(self, action):
+        sim = self.sim
+        # the goal check at the start of the step sees last frame's bounce count
+        bounce_count = sim.bounce_count
+        score = sim.step(self.opponent_action(), int(action) - 1)
+        reward = self.reward(score, bounce_count)
+        truncated = sim.frame_count >= self.max_frames and not sim.game_over_flag
+        info = {"frame": sim.frame_count, "scores": [p.score for p in sim.players]}
+        if truncated:
+            info["truncated"] = True
+        return self.observe(), reward, sim.game_over_flag or truncated, info
+
+    def opponent_hold_frames(self):
+        """Frames the opponent's last decision is certain to repeat, 1 unless it is a predictable scripted one"""
+        if hasattr(self.opponent, "hold_frames"):
+            return self.opponent.hold_frames(self.sim.player1.moved(self.sim.height))
+        return 1
+
+    def hold(self, action, frames):
+        """step() with action held for up to frames frames, stopping early at a goal or the end.
+
+        Stretches where the ball flies straight and the opponent's move is certain to
+        repeat are jumped with PongSim.fast_forward rather than stepped frame by frame,
+        with the same outcome. info["frames"] is how many frames were played.
+        """
+        sim = self.sim
+        start = sim.frame_count
+        score = reward = 0
+        while not score and not sim.game_over_flag and sim.frame_count - start < frames and \
+                sim.frame_count < self.max_frames:
+            bounce_count = sim.bounce_count
+            opponent_action = self.opponent_action()
+            limit = min(frames - (sim.frame_count - start), self.max_frames - sim.frame_count,
+                        self.opponent_hold_frames())
+            if limit > 1:
+                _, score = sim.fast_forward((opponent_action, int(action) - 1), limit)
+            else:
+                score = sim.step(opponent_action, int(action) - 1)
+            reward = self.reward(score, bounce_count)
+        truncated = sim.frame_count >= self.max_frames and not sim.game_over_flag
+        info = {"frame": sim.frame_count, "frames": sim.frame_count - start,
+                "scores": [p.score for p in sim.players]}
+        if truncated:
+            info["truncated"] = True
+        return self.observe(), reward, sim.game_over_flag or truncated, info
+
+    def reward(self, score, bounce_count):
+        if score == -1:
+            return 1 if bounce_count > 0 else 0
+        return -1 if score == 1 else 0
+
+    def render(self, mode="human"):
+        return self.sim.observe().reshape((self.width, self.height)).T
+
+    def close(self):
+        pass
+
+
+class SquashEnv(PongEnv):
+    """Squash against the right hand wall, rewards are the same as qai.SquashAIPlayer"""
+
+    reward_range = (-np.inf, np.inf)
+
+    def __init__(self, width=80, height=60, seed=None, max_frames=10000, observation_size=None):
+        super().__init__(width, height, seed, max_frames=max_frames, observation_size=observation_size)
+
+    def make_sim(self, seed):
+        return SquashSim(self.width, self.height, seed=seed)
+
+    def make_opponent(self, seed):
+        return None
+
+    def step(self, action):
+        sim = self.sim
+        sim.step(int(action) - 1)
+        truncated = sim.frame_count >= self.max_frames and not sim.game_over_flag
+        info = {"frame": sim.frame_count, "scores": [sim.player1.score]}
+        if truncated:
+            info["truncated"] = True
+        return self.observe(), sim.player1.score / 10, sim.game_over_flag or truncated, info
+
+    def hold(self, action, frames):
+        """step() with action held for up to frames frames, the rewards of the frames summed"""
+        sim = self.sim
+        start = sim.frame_count
+        reward = 0
+        while not sim.game_over_flag and sim.frame_count - start < frames and sim.frame_count < self.max_frames:
+            score = sim.player1.score
+            advanced, _ = sim.fast_forward((int(action) - 1,), min(frames - (sim.frame_count - start),
+                                                                   self.max_frames - sim.frame_count))
+            # the jumped frames all pay the score as it was, the stepped one the score after it
+            reward += ((advanced - 1) * score + sim.player1.score) / 10
+        truncated = sim.frame_count >= self.max_frames and not sim.game_over_flag
+        info = {"frame": sim.frame_count, "frames": sim.frame_count - start, "scores": [sim.player1.score]}
+        if truncated:
+            info["truncated"] = True
+        return self.observe(), reward, sim.game_over_flag or truncated, info
+
+
+class CatchEnv(_Env):
+    """PlayCatch.Catch, +1 for catching the fruit and -1 for missing it"""
+
+    metadata = {"render.modes": []}
+    reward_range = (-1, 1)
+
+    def __init__(self, grid_size=10, seed=None):
+        self.grid_size = grid_size
+        self.game = Catch(grid_size, seed=seed)
+        self.observation_space = Box(0., 1., (grid_size * grid_size,), dtype=np.float32)
+        self.action_space = Discrete(3)
+
+    def seed(self, seed=None):
+        self.game.rng = np.random.RandomState(seed)
+        return [seed]
+
+    def reset(self):
+        self.game.reset()
+        return self.game.observe()[0].astype(np.float32)
+
+    def step(self, action):
+        observation, reward, game_over = self.game.act(int(action))
+        return observation[0].astype(np.float32), reward, game_over, {}
+
+    def render(self, mode="human"):
+        return self.game.observe().reshape((self.grid_size, self.grid_size))
+
+    def close(self):
+        pass
+
+
+def train(config, env=None, callback=None):
+    """Train a DQNAgent headless on an environment, by default PongEnv at config.width x
+    config.height. The model's input is config.width x config.height, so an env with a
+    different resolution needs an observation_size to match."""
+    agent = DQNAgent(config)
+    if env is None:
+        env = PongEnv(config.width, config.height, seed=config.seed)
+    broadcaster = FrameBroadcaster.for_config(config)
+
+    def run_episode(e, seed):
+        env.seed(seed)
+        state = env.reset()[np.newaxis]
+        total_reward = 0
+        frames = 0
+        game_over = False
+        while not game_over:
+            action = agent.act(state)
+            next_state, reward, game_over, info = env.step(action)
+            next_state = next_state[np.newaxis]
+            agent.observe(state, action, reward, next_state, game_over, info.get("truncated", False))
+            if broadcaster is not None:
+                broadcaster.publish(next_state, info.get("scores", ()), frames)
+            state = next_state
+            total_reward += reward
+            frames += 1
+        return {"score": total_reward, "frames": frames}
+
+    try:
+        return Trainer(config, [agent], run_episode, callback).run()
+    finally:
+        if broadcaster is not None:
+            broadcaster.close()
+
+
+def train_vector(config, envs, steps_per_epoch=1000, callback=None):
+    """Train on the M games of a vector env such as SubprocVectorEnv, an epoch is steps_per_epoch steps of all of them.
+
+    Every game has its own DQNAgent, replay and epsilon schedule (see qexplore,
+    epsilon_alpha spreads them Ape-X style) and they all share one model. Each
+    step the agents decide whether they explore first and only the other games'
+    observations go through the network, in one batch.
+    """
+    model = DQNAgent(config).model
+    seed = 0 if config.seed is None else config.seed
+    agents = [DQNAgent(config, model, seed=seed + n, actor=n, num_actors=envs.num_envs) for n in range(envs.num_envs)]
+    states = list()
+    returns = np.zeros(envs.num_envs)
+
+    def run_episode(e, _):
+        if not states:
+            states.extend(envs.reset()[:, np.newaxis])
+        finished = list()
+        for _ in range(steps_per_epoch):
+            actions = act_batch(agents, states)
+            observations, rewards, dones, infos = envs.step(actions)
+            returns[:] += rewards
+            for n, agent in enumerate(agents):
+                next_state = infos[n]["terminal_observation"] if dones[n] else observations[n]
+                agent.observe(states[n], actions[n], rewards[n], next_state[np.newaxis], dones[n],
+                              infos[n].get("truncated", False))
+                states[n] = observations[n][np.newaxis]
+                if dones[n]:
+                    finished.append(returns[n])
+                    returns[n] = 0
+        return {"score": float(np.mean(finished)) if finished else 0., "episodes": len(finished),
+                "frames": steps_per_epoch * envs.num_envs}
+
+    return Trainer(config, agents, run_episode, callback).run()
+
+
+def evaluate(model, env, episodes=20, seed=0, action_repeat=1):
+    """Mean reward of greedy play over episodes.
+
+    With action_repeat above 1 each greedy action is held for that many frames with
+    env.hold, which a PongEnv fast forwards where the game allows.
+    """
+    total_reward = 0
+    for episode in range(episodes):
+        env.seed(seed + episode)
+        state = env.reset()
+        game_over = False
+        while not game_over:
+            action = int(np.argmax(model.predict(state[np.newaxis])[0]))
+            if action_repeat > 1:
+                state, reward, game_over, _ = env.hold(action, action_repeat)
+            else:
+                state, reward, game_over, _ = env.step(action)
+            total_reward += reward
+    return total_reward / episodes
+
+
+def _worker(index, make_env, connection, shared_observations, shared_rewards, shared_dones):
+    observations = np.frombuffer(shared_observations, dtype=np.float32).reshape((len(shared_dones), -1))
+    rewards = np.frombuffer(shared_rewards, dtype=np.float64)
+    dones = np.frombuffer(shared_dones, dtype=np.bool_)
+    env = make_env()
+    connection.send(None)
+    try:
+        while True:
+            command, action = connection.recv()
+            if command == "step":
+                observation, reward, done, info = env.step(action)
+                if done:
+                    # auto reset like gym's vector envs, the last frame goes back in info
+                    info["terminal_observation"] = observation
+                    observation = env.reset()
+                observations[index] = observation
+                rewards[index] = reward
+                dones[index] = done
+                connection.send(info)
+            elif command == "reset":
+                observations[index] = env.reset()
+                connection.send(None)
+            elif command == "close":
+                break
+    except (KeyboardInterrupt, EOFError):
+        pass
+    finally:
+        env.close()
+        connection.close()
+
+
+class SubprocVectorEnv:
+    """M environments stepped in lockstep, one process each.
+
+    make_envs is a list of picklable callables that build an environment, for example
+    functools.partial(PongEnv, seed=n). step() takes M actions and returns
+    (observations (M, n), rewards (M,), dones (M,), infos), environments that finish
+    are reset straight away with their final observation in info["terminal_observation"].
+    With copy=False the returned observations are the shared buffer itself, which is
+    only valid until the next step. Like a single environment, call reset() first.
+    """
+
+    def __init__(self, make_envs, copy=True, context=None):
+        context = context or multiprocessing.get_context()
+        probe = make_envs[0]()
+        self.observation_space = probe.observation_space
+        self.action_space = probe.action_space
+        probe.close()
+
+        self.num_envs = len(make_envs)
+        self.copy = copy
+        size = int(np.prod(self.observation_space.shape))
+        shared_observations = context.RawArray(ctypes.c_float, self.num_envs * size)
+        shared_rewards = context.RawArray(ctypes.c_double, self.num_envs)
+        shared_dones = context.RawArray(ctypes.c_bool, self.num_envs)
+        self.observations = np.frombuffer(shared_observations, dtype=np.float32).reshape((self.num_envs, size))
+        self.rewards = np.frombuffer(shared_rewards, dtype=np.float64)
+        self.dones = np.frombuffer(shared_dones, dtype=np.bool_)
+
+        self.connections = list()
+        self.processes = list()
+        for index, make_env in enumerate(make_envs):
+            parent, child = context.Pipe()
+            process = context.Process(target=_worker, daemon=True,
+                                      args=(index, make_env, child, shared_observations, shared_rewards, shared_dones))
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+        for connection in self.connections:
+            connection.recv()
+        self.closed = False
+
+    def _result(self, array):
+        return array.copy() if self.copy else array
+
+    def reset(self):
+        for connection in self.connections:
+            connection.send(("reset", None))
+        for connection in self.connections:
+            connection.recv()
+        return self._result(self.observations)
+
+    def step_async(self, actions):
+        for connection, action in zip(self.connections, actions):
+            connection.send(("step", int(action)))
+
+    def step_wait(self):
+        infos = [connection.recv() for connection in self.connections]
+        return self._result(self.observations), self.rewards.copy(), self.dones.copy(), infos
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self.closed:
+            return
+        for connection in self.connections:
+            try:
+                connection.send(("close", None))
+            except (BrokenPipeError, EOFError):
+                pass
+        for process in self.processes:
+            process.join()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,46 @@
+"""Epsilon schedules for epsilon greedy exploration.
+
+A schedule maps an agent's step count to its epsilon. TrainConfig's epsilon is
+where it starts, epsilon_final and epsilon_steps anneal it linearly, and
+epsilon_alpha gives every actor its own fixed ratio of exploration the way Ape-X
+does: actor i of N uses epsilon ** (1 + alpha * i / (N - 1)), so a few actors
+explore a lot while the rest play almost greedily.
+
+Agents decide whether to explore before they look at the network (see
+qtrain.DQNAgent.explore and qtrain.act_batch), so exploring steps cost no
+inference at all.
+"""
+
+
+def actor_epsilon(epsilon, actor=0, num_actors=1, alpha=None):
+    """Ape-X epsilon of actor out of num_actors, epsilon itself without an alpha or a single actor"""
+    if alpha is None or num_actors < 2:
+        return epsilon
+    return epsilon ** (1 + alpha * actor / (num_actors - 1))
+
+
+class EpsilonSchedule:
+    """Linear from start to final over steps, then constant"""
+
+    def __init__(self, start, final=None, steps=0):
+        self.start = start
+        self.final = start if final is None else final
+        self.steps = steps
+
+    @classmethod
+    def for_config(cls, config, actor=0, num_actors=1):
+        start = actor_epsilon(config.epsilon, actor, num_actors, config.epsilon_alpha)
+        final = None
+        if config.epsilon_final is not None:
+            final = actor_epsilon(config.epsilon_final, actor, num_actors, config.epsilon_alpha)
+        return cls(start, final, config.epsilon_steps)
+
+    def __call__(self, step):
+        if step >= self.steps:
+            return self.final
+        return self.start + (self.final - self.start) * step / self.steps
+
+    def __str__(self):
+        if self.start == self.final:
+            return "epsilon {:.3f}".format(self.start)
+        return "epsilon {:.3f} to {:.3f} over {} steps".format(self.start, self.final, self.steps)
@@ -4,6 +4,15 @@ from enum import Enum
 import pygame
 import sge
 
+from qgeometry import Geometry
+from qopponent import TrackingController
+from qraster import rasterise
+from qsim import crossed, overlaps, quantize
+
+# human play runs at a fixed real time rate, training runs as fast as the machine allows
+REALTIME_FPS = 120
+UNCAPPED_FPS = 100000
+
 
 class SharedVisualMemory:
     """To save memory multiple AI share the visual memory system
@@ -49,8 +58,44 @@ class Game(sge.dsp.Game):
     player2 = 0  # should be set to player 2 object if 2 player game
 
     shared_visual_memory = SharedVisualMemory(max_memory=30)
+    episode_log = None  # set to a qrecord.EpisodeLog to record every action taken
+    frame_broadcaster = None  # set to a qview.FrameBroadcaster to let a viewer watch
+
+    def __init__(self, width, height, realtime=True, render_every=1, seed=None, **kwargs):
+        """realtime paces the loop for human play, otherwise the loop runs uncapped.
+        Either way delta timing is off, so every frame is one fixed simulation step.
+        render_every draws the window every Nth frame (0 never draws). A skipped frame
+        does none of SGE's drawing, no clearing, background, sprites or display flip,
+        and observations are rasterised from the game state instead of the screen.
+        seed drives this game's own random stream, so the same seed and actions replay
+        the same episode.
+        """
+        fps = REALTIME_FPS if realtime else UNCAPPED_FPS
+        super().__init__(width=width, height=height, fps=fps, delta=False, **kwargs)
+        self.realtime = realtime
+        self.render_every = render_every
+        self.frame_count = 0
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.geometry = Geometry(width, height)
+        self.x_scalar = self.geometry.x_scalar
+        self.y_scalar = self.geometry.y_scalar
+
+    def make_sprites(self):
+        """White paddle and ball sprites at whole pixel sizes and the background with the net"""
+        width, height, origin_x, origin_y = self.geometry.paddle
+        self.paddle_sprite = sge.gfx.Sprite(width=width, height=height, origin_x=origin_x, origin_y=origin_y)
+        width, height, origin_x, origin_y = self.geometry.ball
+        self.ball_sprite = sge.gfx.Sprite(width=width, height=height, origin_x=origin_x, origin_y=origin_y)
+        for sprite in (self.paddle_sprite, self.ball_sprite):
+            sprite.draw_rectangle(0, 0, sprite.width, sprite.height, fill=sge.gfx.Color("white"))
+
+        layers = [sge.gfx.BackgroundLayer(self.paddle_sprite, sge.game.width / 2, 0, -10000,
+                                          repeat_up=True, repeat_down=True)]
+        self.background = sge.gfx.Background(layers, sge.gfx.Color("black"))
 
     def event_step(self, time_passed, delta_mult):
+        self.frame_count += 1
         self.observe_world()
         self.check_scored_goal()
 
@@ -64,12 +109,33 @@ class Game(sge.dsp.Game):
     def _grab_screenshot(self):
         return pygame.surfarray.pixels_red(sge.gfx.Sprite.from_screenshot().rd["baseimages"][0])
 
+    def _rasterise(self):
+        objects = [self.player1, self.ball]
+        if type(self.player2) != int: objects.append(self.player2)
+        boxes = [(obj.bbox_left, obj.bbox_top, obj.bbox_width, obj.bbox_height) for obj in objects]
+        return rasterise(self.width, self.height, boxes, self.geometry.net())
+
     def _observe(self):
-        screen = self._grab_screenshot() * (1 / 255)
+        if self.render_every == 1:
+            screen = self._grab_screenshot() * (1 / 255)
+        else:
+            screen = self._rasterise()
         return screen.reshape((1, -1))
 
+    def draw_this_frame(self):
+        return self.render_every > 0 and self.frame_count % self.render_every == 0
+
+    def refresh(self):
+        # all of SGE's drawing happens in refresh, skipping it skips the whole frame's drawing
+        if self.draw_this_frame():
+            super().refresh()
+
     def observe_world(self):
-        self.shared_visual_memory.remember(self._observe())
+        observation = self._observe()
+        self.shared_visual_memory.remember(observation)
+        if self.frame_broadcaster is not None:
+            scores = [self.player1.score] if type(self.player2) == int else [self.player1.score, self.player2.score]
+            self.frame_broadcaster.publish(observation, scores, self.frame_count)
 
     def event_key_press(self, key, char):
         if key == 'f8':
@@ -123,6 +189,7 @@ class Player(sge.dsp.Object):
     def __init__(self, playerNum, paddle_x_offset=8, paddle_speed=4, paddle_vertical_force=1 / 12):
         self.playerNum = playerNum
         self.paddle_x_offset = paddle_x_offset
+        self.base_paddle_speed = paddle_speed  # at 80x60, scaled to the game in set_game
         self.paddle_speed = paddle_speed
         self.paddle_vertical_force = paddle_vertical_force
         self.score = 0
@@ -130,13 +197,14 @@ class Player(sge.dsp.Object):
     def set_game(self, game):
         self.game = game
         self.score = 0
+        self.paddle_speed = quantize(game.geometry.speed_y(self.base_paddle_speed))
         y = self.game.height / 2
 
         if self.playerNum == 1:
-            x = self.paddle_x_offset * self.game.x_scalar
+            x = self.game.geometry.x(self.paddle_x_offset)
             self.hit_direction = 1
         else:
-            x = sge.game.width - self.paddle_x_offset * self.game.x_scalar
+            x = sge.game.width - self.game.geometry.x(self.paddle_x_offset)
             self.hit_direction = -1
 
         super().__init__(x, y, sprite=game.paddle_sprite, checks_collisions=False)
@@ -146,6 +214,8 @@ class Player(sge.dsp.Object):
         self.y = self.game.height / 2
 
     def perform_action(self, action):
+        if self.game.episode_log is not None:
+            self.game.episode_log.record(self.playerNum, action)
         self.yvelocity = action.value * self.paddle_speed
 
     def event_step(self, time_passed, delta_mult):
@@ -183,13 +253,51 @@ class HumanPlayer(Player):
         super().event_step(time_passed, delta_mult)
 
 
+class ScriptedPlayer(Player):
+    """Computer opponent driven by a qopponent.TrackingController, nobody needs to be at the keys
+    """
+
+    def __init__(self, playerNum, controller=None):
+        super().__init__(playerNum)
+        self.controller = controller if controller is not None else TrackingController()
+
+    def set_game(self, game):
+        super().set_game(game)
+        self.controller.reset()
+
+    def event_step(self, time_passed, delta_mult):
+        action = self.controller.decide(self.game.ball, self, self.hit_direction, self.game.height)
+        super().perform_action(PlayerActions(action))
+        super().event_step(time_passed, delta_mult)
+
+
+class LogPlayer(Player):
+    """Plays back the actions recorded for this player in a qrecord.EpisodeLog
+    """
+
+    def __init__(self, playerNum, log):
+        super().__init__(playerNum)
+        self.actions = log.player_actions(playerNum)
+        self.action_index = 0
+
+    def event_step(self, time_passed, delta_mult):
+        if self.action_index < len(self.actions):
+            action = PlayerActions(self.actions[self.action_index])
+        else:
+            action = PlayerActions.stay
+        self.action_index += 1
+        super().perform_action(action)
+        super().event_step(time_passed, delta_mult)
+
+
 class Ball(sge.dsp.Object):
     def __init__(self, game, start_speed=2, acceleration=0.2, max_speed=15):
         self.game = game
         self.game.ball = self
-        self.start_speed = start_speed
-        self.acceleration = acceleration
-        self.max_speed = max_speed
+        # the same exact speeds as qsim, so the headless games play the same frames
+        self.start_speed = quantize(game.geometry.speed_x(start_speed))
+        self.acceleration = quantize(game.geometry.speed_x(acceleration))
+        self.max_speed = quantize(game.geometry.speed_x(max_speed))
         x = sge.game.width / 2
         y = sge.game.height / 2
         super(Ball, self).__init__(x, y, sprite=self.game.ball_sprite)
@@ -206,6 +314,16 @@ class Ball(sge.dsp.Object):
             self.bbox_top = 0
             self.yvelocity = abs(self.yvelocity)
 
+    def event_end_step(self, time_passed, delta_mult):
+        # SGE only reports overlaps, a ball fast enough to jump clean over a paddle in one
+        # frame would pass through it. Same swept test as qsim over this frame's moves,
+        # everything has moved by now and xprevious/yprevious are only set after this.
+        for player in (self.game.player1, self.game.player2):
+            if type(player) == int or overlaps(self, player):
+                continue
+            if crossed(self, player, self.x - self.xprevious, self.y - self.yprevious, player.y - player.yprevious):
+                self.event_collision(player, 0, 0)
+
     def event_collision(self, other, xdirection, ydirection):
         if isinstance(other, Player):
             if other.hit_direction == 1:
@@ -215,16 +333,19 @@ class Ball(sge.dsp.Object):
 
             self.xvelocity = min(abs(self.xvelocity) + self.acceleration,
                                  self.max_speed) * other.hit_direction
-            self.yvelocity += (self.y - other.y) * other.paddle_vertical_force
+            self.yvelocity += quantize((self.y - other.y) * other.paddle_vertical_force)
 
             other.collide_with_ball()
 
     def serve(self, direction=None):
         if direction is None:
-            direction = random.choice([-1, 1])
+            direction = self.game.rng.choice([-1, 1])
 
         self.x = self.xstart
         self.y = self.ystart
+        # a serve isn't a move, event_end_step must not sweep the ball back to the centre
+        self.xprevious = self.x
+        self.yprevious = self.y
         self.game.bounce_count = 0
         self.xvelocity = self.start_speed * direction
         self.yvelocity = 0
@@ -0,0 +1,45 @@
+"""Sizes and speeds of the Pong and Squash objects at any resolution.
+
+Sprite sizes are designed at 160x120 and speeds at 80x60, the resolution training
+has always used, and both are scaled to the real resolution. Sizes and positions
+are rounded to whole pixels, never less than one, so an object covers the same
+number of pixels every frame and looks the same at every resolution. The SGE games
+and the headless qsim games share this so they stay the same game.
+"""
+SPRITE_WIDTH = 160
+SPRITE_HEIGHT = 120
+SPEED_WIDTH = 80
+SPEED_HEIGHT = 60
+PADDLE_LENGTH = 16
+
+
+def pixels(value, minimum=1):
+    return max(int(value + .5), minimum)
+
+
+class Geometry:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.x_scalar = width / SPRITE_WIDTH
+        self.y_scalar = height / SPRITE_HEIGHT
+        # (width, height, origin_x, origin_y)
+        self.paddle = (pixels(3 * self.x_scalar), pixels(PADDLE_LENGTH * self.y_scalar),
+                       pixels(2 * self.x_scalar, 0), pixels(2 * self.y_scalar, 0))
+        self.ball = (pixels(3 * self.x_scalar), pixels(4 * self.y_scalar),
+                     pixels(2 * self.x_scalar, 0), pixels(4 * self.y_scalar, 0))
+
+    def x(self, value):
+        """A 160 wide x position or distance in whole pixels"""
+        return pixels(value * self.x_scalar, 0)
+
+    def speed_x(self, value):
+        """An 80 wide horizontal speed, acceleration or speed limit at this resolution"""
+        return value * self.width / SPEED_WIDTH
+
+    def speed_y(self, value):
+        return value * self.height / SPEED_HEIGHT
+
+    def net(self):
+        """(left, width) of the full height net"""
+        return self.width / 2 - self.paddle[2], self.paddle[0]
@@ -0,0 +1,129 @@
+import json
+import os
+import random
+from multiprocessing import Pool
+from os import path
+
+from qpolicy import NumpyPolicy, save_weights, load_weights
+from qraster import mirror
+from qsim import PongSim
+
+
+def expected_score(rating_a, rating_b):
+    return 1 / (1 + 10 ** ((rating_b - rating_a) / 400))
+
+
+class League:
+    """Pool of frozen snapshots of the learner with Elo style ratings.
+
+    Snapshots are .npz weight files in directory, league.json holds the ratings so a
+    league outlives the process. Matches are played headless between NumpyPolicy
+    opponents across a process pool, workers never import Keras.
+    """
+
+    def __init__(self, directory, width=80, height=60, k_factor=32, initial_rating=1000, seed=None):
+        self.directory = directory
+        self.width = width
+        self.height = height
+        self.k_factor = k_factor
+        self.initial_rating = initial_rating
+        self.rng = random.Random(seed)
+        self.snapshots = dict()
+        os.makedirs(directory, exist_ok=True)
+        if path.isfile(self.index_filename()):
+            with open(self.index_filename(), "r") as infile:
+                self.snapshots = json.load(infile)
+
+    def index_filename(self):
+        return path.join(self.directory, "league.json")
+
+    def save(self):
+        tmp_filename = self.index_filename() + ".tmp"
+        with open(tmp_filename, "w") as outfile:
+            json.dump(self.snapshots, outfile, indent=1)
+        os.replace(tmp_filename, self.index_filename())
+
+    def add_snapshot(self, name, weights, architecture):
+        """Freeze weights (model.get_weights()) into the pool, starting from the best rating
+        the learner has reached so far so a new snapshot isn't a free win for everyone"""
+        filename = path.join(self.directory, name + ".npz")
+        save_weights(filename, weights)
+        rating = max([s["rating"] for s in self.snapshots.values()] + [self.initial_rating])
+        self.snapshots[name] = {"file": filename, "architecture": architecture, "rating": rating, "games": 0}
+        self.save()
+
+    def policy(self, name):
+        snapshot = self.snapshots[name]
+        return NumpyPolicy(load_weights(snapshot["file"]), snapshot["architecture"])
+
+    def sample(self, count=1, exclude=None):
+        names = [name for name in sorted(self.snapshots) if name != exclude]
+        return [self.rng.choice(names) for _ in range(count)] if names else list()
+
+    def update_ratings(self, name_a, name_b, score_a, games):
+        """score_a is the fraction of games won by a, draws count half"""
+        a = self.snapshots[name_a]
+        b = self.snapshots[name_b]
+        expected_a = expected_score(a["rating"], b["rating"])
+        change = self.k_factor * games * (score_a - expected_a)
+        a["rating"] += change
+        b["rating"] -= change
+        a["games"] += games
+        b["games"] += games
+
+    def play_round(self, name, opponents, games_per_match=4, processes=None, max_frames=10000):
+        """Play name against each opponent in parallel and update the ratings,
+        returns [(opponent, score)] with score the fraction of games name won"""
+        snapshot = self.snapshots[name]
+        jobs = [(snapshot["file"], snapshot["architecture"],
+                 self.snapshots[o]["file"], self.snapshots[o]["architecture"],
+                 self.width, self.height, games_per_match, self.rng.randrange(2 ** 31), max_frames)
+                for o in opponents]
+        with Pool(processes) as pool:
+            scores = pool.map(play_match, jobs)
+
+        for opponent, score in zip(opponents, scores):
+            self.update_ratings(name, opponent, score, games_per_match)
+        self.save()
+        return list(zip(opponents, scores))
+
+    def standings(self):
+        return sorted(((s["rating"], name, s["games"]) for name, s in self.snapshots.items()), reverse=True)
+
+
+def play_game(policy_right, policy_left, width, height, seed, max_frames, points_to_win=PongSim.points_to_win):
+    """One headless Pong game to points_to_win goals, returns 1 if the right hand player won,
+    0 if it lost, .5 for a draw.
+
+    Both policies see the screen as if they were the right hand player.
+    """
+    sim = PongSim(width, height, seed=seed)
+    # Player.score also pays 5 for every paddle hit, that would end the game at the first
+    # return, so goals are counted here and the sim never ends the game itself
+    sim.points_to_win = float("inf")
+    left_goals = right_goals = 0
+    while max(left_goals, right_goals) < points_to_win and sim.frame_count < max_frames:
+        observation = sim.observe()
+        right = policy_right.act(observation) - 1
+        left = policy_left.act(mirror(observation, width, height)) - 1
+        goal = sim.step(left, right)
+        left_goals += goal == 1
+        right_goals += goal == -1
+
+    if right_goals == left_goals:
+        return .5
+    return 1. if right_goals > left_goals else 0.
+
+
+def play_match(job):
+    """Process pool worker, a's fraction of games won against b, sides alternate each game"""
+    file_a, architecture_a, file_b, architecture_b, width, height, games, seed, max_frames = job
+    a = NumpyPolicy(load_weights(file_a), architecture_a)
+    b = NumpyPolicy(load_weights(file_b), architecture_b)
+    score = 0.
+    for game in range(games):
+        if game % 2 == 0:
+            score += play_game(a, b, width, height, seed + game, max_frames)
+        else:
+            score += 1 - play_game(b, a, width, height, seed + game, max_frames)
+    return score / games
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""Data-parallel Q-learning, K learner processes training one network.
+
+Every learner holds a replica of a qmlp.NumpyMLP, samples its own batch from a
+shared qreplay replay and writes its gradient straight into its row of a shared
+memory segment. After a barrier each learner averages one Kth of the gradient
+across all rows, and after a second barrier every replica applies the same
+averaged gradient. Each replica runs the same optimizer on the same numbers, so
+they stay identical without weights ever being sent. Learner 0 publishes the
+weights into the segment after every train() call. Actors read them from there
+with get_weights(), so the segment doubles as a parameter server.
+
+Run one BLAS thread per process (OMP_NUM_THREADS=1) or the learners fight over cores.
+
+    python3 qlearners.py --actors 2 --learners 4 --steps 2000
+"""
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+
+from qexplore import EpsilonSchedule
+from qmodels import build_model
+from qreplay import ReplaySampler
+from qshm import Layout, SharedSegment
+
+HEADER_FIELDS = 3  # learners, parameter count, weights version
+
+
+def learner_layout(num_learners, size):
+    return Layout([("header", (HEADER_FIELDS,), np.int64),
+                   ("weights", (size,), np.float32),
+                   ("grads", (num_learners, size), np.float32),
+                   ("average", (size,), np.float32)])
+
+
+def split(flat, shapes):
+    """Views of a flat array as arrays of shapes, one after another"""
+    views = list()
+    offset = 0
+    for shape in shapes:
+        size = int(np.prod(shape))
+        views.append(flat[offset:offset + size].reshape(shape))
+        offset += size
+    return views
+
+
+class SharedWeights:
+    """The published weights of a learner segment, from any process"""
+
+    def __init__(self, name):
+        self.segment = SharedSegment(name)
+        num_learners, size = self.segment.array(0, (2,), np.int64)
+        arrays = learner_layout(int(num_learners), int(size)).arrays(self.segment)
+        self.header = arrays["header"]
+        self.weights = arrays["weights"]
+
+    def publish(self, weights):
+        self.header[2] += 1  # odd, being written
+        np.concatenate([np.ravel(w) for w in weights], out=self.weights)
+        self.header[2] += 1
+
+    def get_weights(self, shapes, max_retries=100):
+        """A copy of the newest complete weights, as arrays of shapes"""
+        for _ in range(max_retries):
+            before = int(self.header[2])
+            weights = self.weights.copy()
+            if before % 2 == 0 and int(self.header[2]) == before:
+                return split(weights, shapes)
+        raise RuntimeError("Weights kept changing while being read")
+
+    def close(self):
+        self.header = None
+        self.weights = None
+        self.segment.close()
+
+
+def _learner(rank, name, config, replay_name, num_shards, shapes, connection, barrier, seed):
+    segment = SharedSegment(name)
+    num_learners, size = segment.array(0, (2,), np.int64)
+    arrays = learner_layout(int(num_learners), int(size)).arrays(segment)
+    weights = SharedWeights(name) if rank == 0 else None
+
+    model = build_model(config.architecture, config.width, config.height, config.num_actions, backend="numpy")
+    model.set_weights(split(arrays["weights"], shapes))
+    model.grads = split(arrays["grads"][rank], shapes)  # gradients are written straight into shared memory
+    average = split(arrays["average"], shapes)
+    target_model = None
+    if config.target_update:
+        target_model = build_model(config.architecture, config.width, config.height, config.num_actions,
+                                   backend="numpy")
+    # each learner reduces one slice of the gradient
+    bounds = np.linspace(0, int(size), int(num_learners) + 1).astype(np.int64)
+    lo, hi = bounds[rank], bounds[rank + 1]
+    grads = arrays["grads"]
+    sampler = None
+    step = 0
+    connection.send(None)
+    try:
+        while True:
+            command, steps = connection.recv()
+            if command == "close":
+                break
+            if sampler is None:
+                # attached on the first train, the actors writing the shards may start after the learners
+                sampler = ReplaySampler(replay_name, num_shards, rng=np.random.RandomState(seed))
+            losses = list()
+            for _ in range(steps):
+                if target_model is not None and step % config.target_update == 0:
+                    target_model.set_weights(model.get_weights())
+                step += 1
+                inputs, targets = sampler.get_batch(model, config.batch_size, target_model, config.double_dqn)
+                losses.append(model.gradients(inputs, targets))
+                barrier.wait()
+                np.mean(grads[:, lo:hi], axis=0, out=arrays["average"][lo:hi])
+                barrier.wait()
+                model.apply_gradients(average)
+            if weights is not None:
+                weights.publish(model.params)
+            connection.send(float(np.mean(losses)) if losses else 0.)
+    except (KeyboardInterrupt, EOFError):
+        pass
+    except Exception:
+        barrier.abort()  # the other learners would wait for this one forever
+        raise
+    finally:
+        if sampler is not None:
+            sampler.close()
+        if weights is not None:
+            weights.close()
+        # the views have to go before the mapping can be closed
+        model.grads = average = grads = arrays = None
+        segment.close()
+        connection.close()
+
+
+class DataParallelLearners:
+    """num_learners processes training a NumpyMLP of config's architecture on the replay called replay_name.
+
+    Every step each learner samples config.batch_size transitions, so one step
+    learns from num_learners * batch_size. The learners attach to the replay on the
+    first train(), by then its shards must exist and hold transitions. replace=True
+    replaces a segment called name left behind by a crashed run.
+    """
+
+    def __init__(self, name, config, replay_name, num_shards, num_learners, model=None, context=None,
+                 replace=False):
+        context = context or multiprocessing.get_context()
+        if model is None:
+            if config.seed is not None:
+                np.random.seed(config.seed)
+            model = build_model(config.architecture, config.width, config.height, config.num_actions,
+                                backend="numpy")
+        self.shapes = [p.shape for p in model.params]
+        size = sum(p.size for p in model.params)
+        self.segment = SharedSegment(name, learner_layout(num_learners, size).size, create=True, replace=replace)
+        self.num_learners = num_learners
+        self.steps = 0
+        self.connections = list()
+        self.processes = list()
+        try:
+            self.segment.array(0, (2,), np.int64)[:] = (num_learners, size)
+            self.weights = SharedWeights(name)
+            self.weights.publish(model.get_weights())
+
+            barrier = context.Barrier(num_learners)
+            for rank in range(num_learners):
+                seed = None if config.seed is None else config.seed * 1000 + rank
+                parent, child = context.Pipe()
+                process = context.Process(target=_learner, daemon=True,
+                                          args=(rank, name, config, replay_name, num_shards, self.shapes, child,
+                                                barrier, seed))
+                process.start()
+                child.close()
+                self.connections.append(parent)
+                self.processes.append(process)
+            for connection in self.connections:
+                self._recv(connection)
+        except BaseException:
+            # the segment would otherwise stop the next run from creating it
+            for process in self.processes:
+                process.terminate()
+            self.segment.unlink()
+            raise
+
+    def _recv(self, connection):
+        try:
+            return connection.recv()
+        except EOFError:
+            raise RuntimeError("A learner process died, exit codes {}".format(
+                [process.exitcode for process in self.processes]))
+
+    def train(self, steps):
+        """Take steps synchronous updates, returns the mean loss"""
+        for connection in self.connections:
+            connection.send(("train", steps))
+        losses = [self._recv(connection) for connection in self.connections]
+        self.steps += steps
+        return float(np.mean(losses))
+
+    def get_weights(self):
+        return self.weights.get_weights(self.shapes)
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(("close", 0))
+        for process in self.processes:
+            process.join()
+        self.weights.close()
+        self.segment.close()
+        self.segment.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _actor(shard, num_actors, config, replay_name, learners_name, shapes, ready, stop, seed, replace):
+    from qenv import PongEnv
+    from qpolicy import NumpyPolicy
+    from qreplay import ReplayShard
+
+    env = PongEnv(config.width, config.height, seed=seed)
+    replay = ReplayShard(replay_name, shard, config.max_memory, config.width * config.height, config.n_step,
+                         config.discount, replace)
+    weights = SharedWeights(learners_name)
+    rng = np.random.RandomState(seed)
+    schedule = EpsilonSchedule.for_config(config, shard, num_actors)
+    steps = 0
+    ready.set()
+    try:
+        while not stop.is_set():
+            # pick up the newest weights once per episode
+            policy = NumpyPolicy(weights.get_weights(shapes), config.architecture)
+            state = env.reset()
+            game_over = False
+            while not game_over and not stop.is_set():
+                # decided before inference, exploring steps never touch the network
+                if rng.rand() <= schedule(steps):
+                    action = rng.randint(config.num_actions)
+                else:
+                    action = policy.act(state[np.newaxis])
+                steps += 1
+                next_state, reward, game_over, info = env.step(action)
+                replay.remember(state, action, reward, next_state, game_over, info.get("truncated", False))
+                state = next_state
+    finally:
+        weights.close()
+        replay.close()
+
+
+def train(config, num_actors, num_learners, steps, chunk=100, name="qlearners", context=None, replace=False):
+    """Actors play Pong into a sharded replay while num_learners learners train on it, returns the weights.
+
+    replace=True replaces segments of the same names left behind by a crashed run.
+    """
+    context = context or multiprocessing.get_context()
+    stop = context.Event()
+    actors = list()
+    with DataParallelLearners(name, config, name + "_replay", num_actors, num_learners, context=context,
+                              replace=replace) as learners:
+        try:
+            if config.verbose:
+                print("Exploration | {}".format(", ".join(str(EpsilonSchedule.for_config(config, shard, num_actors))
+                                                          for shard in range(num_actors))))
+            for shard in range(num_actors):
+                ready = context.Event()
+                seed = None if config.seed is None else config.seed + shard
+                actor = context.Process(target=_actor, daemon=True,
+                                        args=(shard, num_actors, config, name + "_replay", name, learners.shapes,
+                                              ready, stop, seed, replace))
+                actor.start()
+                ready.wait()
+                actors.append(actor)
+            sampler = ReplaySampler(name + "_replay", num_actors)
+            while len(sampler) < config.batch_size:
+                time.sleep(.1)
+            sampler.close()
+
+            start = time.perf_counter()
+            while learners.steps < steps:
+                loss = learners.train(min(chunk, steps - learners.steps))
+                if config.verbose:
+                    print("Step {:06d} | Loss {:.4f} | {:.1f} updates/s".format(
+                        learners.steps, loss, learners.steps / (time.perf_counter() - start)))
+            return learners.get_weights()
+        finally:
+            stop.set()
+            for actor in actors:
+                actor.join()
+
+
+if __name__ == '__main__':
+    from qpolicy import save_weights
+    from qtrain import TrainConfig
+
+    parser = argparse.ArgumentParser(description="Train Pong with actor processes and data-parallel learners")
+    parser.add_argument("--actors", type=int, default=2)
+    parser.add_argument("--learners", type=int, default=2)
+    parser.add_argument("--steps", type=int, default=2000)
+    parser.add_argument("--architecture", default="mlp50")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default="qlearners.npz")
+    parser.add_argument("--replace", action="store_true",
+                        help="remove shared memory left behind by a crashed run before starting")
+    args = parser.parse_args()
+
+    config = TrainConfig(architecture=args.architecture, backend="numpy", max_memory=10000, batch_size=32,
+                         n_step=3, target_update=500, epsilon=.4, epsilon_alpha=7, seed=args.seed)
+    save_weights(args.output, train(config, args.actors, args.learners, args.steps, replace=args.replace))
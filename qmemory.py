@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""Memory growth across a long training run.
+
+TrainConfig(memory_profile=True) makes the Trainer take a tracemalloc snapshot
+and read the resident set size at the end of every epoch. It adds both to the
+epoch's stats and logs the allocation sites that grew the most when training
+ends. Growth is the least squares slope over the epochs after a warm up, so
+replay memory filling up and first use caches don't count. tracemalloc only sees
+Python allocations, RSS also catches C side leaks (pygame surfaces, Keras
+sessions) that valgrind_python.sh would otherwise be needed for.
+
+memory_budget is a growth budget in kB per epoch, going over it raises
+MemoryGrowthError once training ends. Run it as a soak test with
+
+    python3 qmemory.py qpong_ai --epochs 200 --budget 64
+"""
+import argparse
+import os
+import tracemalloc
+
+IGNORED_FILES = ("<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>", "<unknown>",
+                 tracemalloc.__file__)
+
+
+class MemoryGrowthError(RuntimeError):
+    pass
+
+
+def rss_kb():
+    """Resident set size of this process in kB, None where /proc isn't available"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError):
+        return None
+
+
+def slope(xs, ys):
+    """Least squares slope of ys over xs"""
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    if variance == 0:
+        return 0.
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance
+
+
+class MemoryTracker:
+    """Samples memory at epoch boundaries, samples taken before warmup epochs don't count towards growth"""
+
+    def __init__(self, warmup=5, top=10, frames=1):
+        self.warmup = warmup
+        self.top = top
+        self.started = not tracemalloc.is_tracing()
+        if self.started:
+            tracemalloc.start(frames)
+        self.samples = list()
+        self.baseline = None
+        self.latest = None
+
+    def snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, filename) for filename in IGNORED_FILES])
+
+    def sample(self, epoch):
+        """Memory use at the end of epoch as stats, {"rss_kb", "traced_kb"}"""
+        traced, _ = tracemalloc.get_traced_memory()
+        sample = {"epoch": epoch, "rss_kb": rss_kb(), "traced_kb": traced / 1024}
+        self.samples.append(sample)
+        if len(self.samples) > self.warmup:
+            self.latest = self.snapshot()
+            if self.baseline is None:
+                self.baseline = self.latest
+        return {"rss_kb": sample["rss_kb"], "traced_kb": sample["traced_kb"]}
+
+    def growth(self):
+        """kB per epoch since the warm up, {"rss_kb": ..., "traced_kb": ...}, empty until there are two samples"""
+        samples = self.samples[self.warmup:]
+        if len(samples) < 2:
+            return dict()
+        epochs = [sample["epoch"] for sample in samples]
+        return {key: slope(epochs, [sample[key] for sample in samples])
+                for key in ("rss_kb", "traced_kb") if samples[0][key] is not None}
+
+    def top_sites(self):
+        """The allocation sites that grew the most since the warm up, as tracemalloc StatisticDiffs"""
+        if self.baseline is None or self.latest is self.baseline:
+            return list()
+        return self.latest.compare_to(self.baseline, "lineno")[:self.top]
+
+    def report(self):
+        if len(self.samples) < 2:
+            return "Memory: not enough epochs sampled"
+        lines = ["Memory: RSS {} kB, traced {:.0f} kB after epoch {}".format(
+            self.samples[-1]["rss_kb"], self.samples[-1]["traced_kb"], self.samples[-1]["epoch"])]
+        lines += ["Growth per epoch after {} warm up epochs: {}".format(self.warmup, ", ".join(
+            "{} {:.1f} kB".format(key, value) for key, value in sorted(self.growth().items())))]
+        lines += ["  {}".format(stat) for stat in self.top_sites()]
+        return "\n".join(lines)
+
+    def check(self, budget_kb):
+        """Raise MemoryGrowthError when RSS or traced memory grew more than budget_kb per epoch"""
+        over = {key: value for key, value in self.growth().items() if value > budget_kb}
+        if over:
+            raise MemoryGrowthError("Memory grew more than {} kB per epoch ({})\n{}".format(
+                budget_kb, ", ".join("{} {:.1f} kB".format(key, value) for key, value in sorted(over.items())),
+                self.report()))
+
+    def stop(self):
+        if self.started:
+            tracemalloc.stop()
+            self.started = False
+
+
+def soak(game, config):
+    """Train config.epoch epochs of game, raising MemoryGrowthError when config.memory_budget is exceeded"""
+    if game in ("qpong_ai", "qsquash_ai"):
+        # the real SGE games, new sprites and rooms every epoch, nothing drawn
+        module = __import__(game)
+        return module.train(config, realtime=False, render_every=0)
+
+    from qenv import CatchEnv, PongEnv, SquashEnv, train
+    envs = {"pong": PongEnv, "squash": SquashEnv}
+    env = CatchEnv(config.width, seed=config.seed) if game == "catch" else \
+        envs[game](config.width, config.height, seed=config.seed)
+    return train(config, env)
+
+
+if __name__ == '__main__':
+    from qtrain import TrainConfig
+
+    parser = argparse.ArgumentParser(description="Soak test, train for a long time and fail if memory keeps growing")
+    parser.add_argument("game", choices=("qpong_ai", "qsquash_ai", "pong", "squash", "catch"),
+                        help="an SGE training script or a headless qenv environment")
+    parser.add_argument("--epochs", type=int, default=200)
+    parser.add_argument("--budget", type=float, default=64, help="allowed growth in kB per epoch")
+    parser.add_argument("--warmup", type=int, default=None, help="epochs left out of the growth, default a fifth")
+    parser.add_argument("--architecture", default="mlp50")
+    parser.add_argument("--backend", choices=("keras", "numpy"), default="keras")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = TrainConfig(epoch=args.epochs,
+                         architecture=args.architecture,
+                         backend=args.backend,
+                         width=10 if args.game == "catch" else 80,
+                         height=10 if args.game == "catch" else 60,
+                         seed=args.seed,
+                         memory_profile=True,
+                         memory_budget=args.budget,
+                         memory_warmup=args.epochs // 5 if args.warmup is None else args.warmup)
+    try:
+        soak(args.game, config)
+    except MemoryGrowthError as e:
+        raise SystemExit("FAILED {}".format(e))
+    print("Memory growth within {} kB per epoch".format(args.budget))
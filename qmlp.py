@@ -0,0 +1,302 @@
+"""A Keras free training backend for the qmodels MLPs.
+
+For networks this small the arithmetic of a train_on_batch is a few hundred
+microseconds and Keras' per call overhead is most of the time. NumpyMLP runs the
+same network, MSE loss and SGD or Adam as build_model with hand written forward
+and backward passes into buffers that are allocated once per batch size.
+Observations are screens that are mostly black, so the first layer only touches
+the weight rows of pixels lit somewhere in the batch.
+
+It has the parts of the Keras model interface the training code uses (predict,
+train_on_batch, get_weights, set_weights, save_weights, load_weights and an
+optimizer with get_weights/set_weights for checkpoints). Weights are in the
+model.get_weights() order and .h5 files use the Keras weight file layout, so either
+backend can pick up where the other left off.
+
+    config = TrainConfig(backend="numpy", architecture="mlp50")
+"""
+import json
+
+import numpy as np
+
+from qmodels import get_architecture, optimizer_settings
+
+DENSE_FRACTION = .5  # above this fraction of lit pixels the first layer is run dense
+
+
+def initial_weights(shape, init, rng):
+    if init == "uniform":
+        return rng.uniform(-.05, .05, size=shape).astype(np.float32)
+    if init == "glorot_uniform":
+        limit = np.sqrt(6 / sum(shape))
+        return rng.uniform(-limit, limit, size=shape).astype(np.float32)
+    if init == "he_uniform":
+        limit = np.sqrt(6 / shape[0])
+        return rng.uniform(-limit, limit, size=shape).astype(np.float32)
+    raise ValueError("Unknown init {}".format(init))
+
+
+class SGD:
+    def __init__(self, lr):
+        self.lr = lr
+        self.iterations = 0
+
+    def update(self, params, grads, rows=None):
+        """rows are the only first layer rows with a non zero gradient, or None for all"""
+        self.iterations += 1
+        for n, (p, g) in enumerate(zip(params, grads)):
+            if n == 0 and rows is not None:
+                p[rows] -= self.lr * g[rows]
+            else:
+                p -= self.lr * g
+
+    def get_weights(self):
+        return [np.array(self.iterations)]
+
+    def set_weights(self, weights):
+        self.iterations = int(weights[0])
+
+
+class Adam:
+    """Adam as Keras implements it, the bias correction is folded into the step size"""
+
+    def __init__(self, lr, params, beta_1=.9, beta_2=.999, epsilon=1e-8):
+        self.lr = lr
+        self.beta_1 = beta_1
+        self.beta_2 = beta_2
+        self.epsilon = epsilon
+        self.iterations = 0
+        self.ms = [np.zeros_like(p) for p in params]
+        self.vs = [np.zeros_like(p) for p in params]
+        self.scratch = [np.empty_like(p) for p in params]
+
+    def update(self, params, grads, rows=None):
+        # every moment decays each step, so the whole first layer is updated even when
+        # only a few of its rows have a gradient
+        self.iterations += 1
+        t = self.iterations
+        lr_t = self.lr * np.sqrt(1 - self.beta_2 ** t) / (1 - self.beta_1 ** t)
+        for p, g, m, v, scratch in zip(params, grads, self.ms, self.vs, self.scratch):
+            m *= self.beta_1
+            m += (1 - self.beta_1) * g
+            v *= self.beta_2
+            np.multiply(g, g, out=scratch)
+            scratch *= 1 - self.beta_2
+            v += scratch
+            np.sqrt(v, out=scratch)
+            scratch += self.epsilon
+            np.divide(m, scratch, out=scratch)
+            scratch *= lr_t
+            p -= scratch
+
+    def get_weights(self):
+        return [np.array(self.iterations)] + [m.copy() for m in self.ms] + [v.copy() for v in self.vs]
+
+    def set_weights(self, weights):
+        self.iterations = int(weights[0])
+        count = len(self.ms)
+        for m, value in zip(self.ms + self.vs, weights[1:1 + 2 * count]):
+            m[...] = value
+
+
+def make_optimizer(name, lr, params):
+    if name == "sgd":
+        return SGD(lr)
+    if name == "adam":
+        return Adam(lr, params)
+    raise ValueError("Unknown optimizer {}".format(name))
+
+
+class _Buffers:
+    """Activations and their gradients for one batch size"""
+
+    def __init__(self, batch_size, sizes, num_heads, num_actions):
+        self.hidden = [np.empty((batch_size, size), dtype=np.float32) for size in sizes]
+        self.hidden_grads = [np.empty((batch_size, size), dtype=np.float32) for size in sizes]
+        self.heads = [np.empty((batch_size, 1 if num_heads == 2 and n == 0 else num_actions), dtype=np.float32)
+                      for n in range(num_heads)]
+        self.outputs = np.empty((batch_size, num_actions), dtype=np.float32)
+
+
+class NumpyMLP:
+    """A qmodels mlp architecture that trains without Keras, see the module docstring"""
+
+    def __init__(self, architecture, width, height, num_actions=3, rng=np.random):
+        config = get_architecture(architecture)
+        if config["type"] != "mlp":
+            raise ValueError("NumpyMLP only trains mlp networks, not {}".format(config["type"]))
+        self.config = config
+        self.width = width
+        self.height = height
+        self.num_actions = num_actions
+        self.dueling = config.get("dueling", False)
+        self.sizes = list(config["hidden"])
+
+        init = config.get("init", "uniform")
+        shapes = list(zip([width * height] + self.sizes[:-1], self.sizes))
+        shapes += [(self.sizes[-1], 1), (self.sizes[-1], num_actions)] if self.dueling \
+            else [(self.sizes[-1], num_actions)]
+        self.params = list()
+        for shape in shapes:
+            self.params += [initial_weights(shape, init, rng), np.zeros(shape[1], dtype=np.float32)]
+        self.grads = [np.zeros_like(p) for p in self.params]
+        self.optimizer = make_optimizer(*optimizer_settings(config), params=self.params)
+        self.buffers = dict()
+        self.rows = None  # first layer rows of the last forward pass, None when it ran dense
+        self.grad_rows = np.empty(0, dtype=np.int64)  # rows of self.grads[0] that may be non zero, None for all
+
+    @property
+    def num_hidden(self):
+        return len(self.sizes)
+
+    def count_params(self):
+        return sum(p.size for p in self.params)
+
+    def get_weights(self):
+        return [p.copy() for p in self.params]
+
+    def set_weights(self, weights):
+        for p, w in zip(self.params, weights):
+            if p.shape != np.shape(w):
+                raise ValueError("Weight shape {} doesn't match {}".format(np.shape(w), p.shape))
+            p[...] = w
+
+    def _buffers(self, batch_size):
+        if batch_size not in self.buffers:
+            self.buffers[batch_size] = _Buffers(batch_size, self.sizes, 2 if self.dueling else 1, self.num_actions)
+        return self.buffers[batch_size]
+
+    def _forward(self, inputs):
+        buffers = self._buffers(len(inputs))
+        w, b = self.params[0], self.params[1]
+        rows = np.flatnonzero(inputs.any(axis=0))
+        if len(rows) > DENSE_FRACTION * len(w):
+            self.rows = None
+            np.dot(inputs, w, out=buffers.hidden[0])
+        else:
+            self.rows = rows
+            np.dot(inputs[:, rows], w[rows], out=buffers.hidden[0])
+        self._activate(buffers.hidden[0], b)
+        for n in range(1, self.num_hidden):
+            np.dot(buffers.hidden[n - 1], self.params[2 * n], out=buffers.hidden[n])
+            self._activate(buffers.hidden[n], self.params[2 * n + 1])
+
+        x = buffers.hidden[-1]
+        for n, head in enumerate(buffers.heads):
+            np.dot(x, self.params[2 * (self.num_hidden + n)], out=head)
+            head += self.params[2 * (self.num_hidden + n) + 1]
+        if self.dueling:
+            value, advantage = buffers.heads
+            np.subtract(advantage, advantage.mean(axis=1, keepdims=True), out=buffers.outputs)
+            buffers.outputs += value
+        else:
+            buffers.outputs[...] = buffers.heads[0]
+        return buffers
+
+    @staticmethod
+    def _activate(x, b):
+        x += b
+        np.maximum(x, 0, out=x)
+
+    def predict(self, inputs, batch_size=None):
+        return self._forward(np.asarray(inputs, dtype=np.float32)).outputs.copy()
+
+    def gradients(self, inputs, targets):
+        """MSE loss of the batch before any update, the gradient is left in self.grads"""
+        inputs = np.asarray(inputs, dtype=np.float32)
+        buffers = self._forward(inputs)
+        error = buffers.outputs - np.asarray(targets, dtype=np.float32)
+        loss = float(np.mean(np.square(error)))
+        error *= 2 / error.size
+
+        head_errors = [error]
+        if self.dueling:
+            head_errors = [error.sum(axis=1, keepdims=True), error - error.mean(axis=1, keepdims=True)]
+        x_grad = buffers.hidden_grads[-1]
+        x_grad[...] = 0
+        for n, head_error in enumerate(head_errors):
+            index = 2 * (self.num_hidden + n)
+            np.dot(buffers.hidden[-1].T, head_error, out=self.grads[index])
+            head_error.sum(axis=0, out=self.grads[index + 1])
+            x_grad += head_error.dot(self.params[index].T)
+
+        for n in range(self.num_hidden - 1, -1, -1):
+            delta = buffers.hidden_grads[n]
+            delta *= buffers.hidden[n] > 0
+            delta.sum(axis=0, out=self.grads[2 * n + 1])
+            if n > 0:
+                np.dot(buffers.hidden[n - 1].T, delta, out=self.grads[2 * n])
+                np.dot(delta, self.params[2 * n].T, out=buffers.hidden_grads[n - 1])
+        self._input_gradient(inputs, buffers.hidden_grads[0])
+        return loss
+
+    def _input_gradient(self, inputs, delta):
+        grad = self.grads[0]
+        if self.rows is None:
+            np.dot(inputs.T, delta, out=grad)
+            self.grad_rows = None
+            return
+        # only rows lit in this batch have a gradient, zero the ones the last batch left
+        if self.grad_rows is None:
+            grad[...] = 0
+        else:
+            grad[self.grad_rows] = 0
+        grad[self.rows] = inputs[:, self.rows].T.dot(delta)
+        self.grad_rows = self.rows
+
+    def apply_gradients(self, grads=None):
+        """Step the optimizer with self.grads, or with grads averaged elsewhere"""
+        if grads is None:
+            self.optimizer.update(self.params, self.grads, self.grad_rows)
+        else:
+            self.optimizer.update(self.params, grads)
+
+    def train_on_batch(self, inputs, targets):
+        loss = self.gradients(inputs, targets)
+        self.apply_gradients()
+        return loss
+
+    def layer_names(self):
+        return ["dense_{}".format(n + 1) for n in range(len(self.params) // 2)]
+
+    def save_weights(self, filename, overwrite=True):
+        save_h5_weights(filename, self.layer_names(), self.params)
+
+    def load_weights(self, filename):
+        self.set_weights(load_h5_weights(filename))
+
+    def to_json(self):
+        return json.dumps({"class_name": "NumpyMLP",
+                           "config": {"architecture": self.config, "width": self.width, "height": self.height,
+                                      "num_actions": self.num_actions}})
+
+
+def save_h5_weights(filename, layer_names, weights):
+    """weights of Dense layers in the Keras weight file layout, layer_names[n] holding weights[2n:2n + 2]"""
+    import h5py
+
+    with h5py.File(filename, "w") as f:
+        f.attrs["layer_names"] = [name.encode("utf8") for name in layer_names]
+        f.attrs["backend"] = b"numpy"
+        for name, w, b in zip(layer_names, weights[0::2], weights[1::2]):
+            group = f.create_group(name)
+            weight_names = ["{}_W".format(name), "{}_b".format(name)]
+            group.attrs["weight_names"] = [weight_name.encode("utf8") for weight_name in weight_names]
+            for weight_name, value in zip(weight_names, (w, b)):
+                group.create_dataset(weight_name, data=value)
+
+
+def load_h5_weights(filename):
+    """Every layer's weights in order from a Keras .h5 weights or model file, the model.get_weights() list"""
+    import h5py
+
+    with h5py.File(filename, "r") as f:
+        if "model_weights" in f:  # a whole model saved with model.save()
+            f = f["model_weights"]
+        weights = list()
+        for layer_name in f.attrs["layer_names"]:
+            group = f[layer_name.decode("utf8") if isinstance(layer_name, bytes) else layer_name]
+            for weight_name in group.attrs["weight_names"]:
+                weight_name = weight_name.decode("utf8") if isinstance(weight_name, bytes) else weight_name
+                weights.append(np.array(group[weight_name], dtype=np.float32))
+        return weights
@@ -0,0 +1,87 @@
+# Named architectures, pick one by name or pass a dict of the same shape to build_model.
+#   type    mlp or conv
+#   hidden  sizes of the fully connected layers (after the convolutions for conv)
+#   conv    (filters, kernel size, stride) per convolution layer, observations are 8 bit
+#           screens so a couple of strided layers shrink them fast
+#   dueling split the head into a state value and per action advantages
+#   init    weight initialisation, default uniform like the original scripts
+#   optimizer sgd (default) or adam
+#   lr      learning rate, default .2 for sgd and .001 for adam
+ARCHITECTURES = {
+    "mlp100": {"type": "mlp", "hidden": [100, 100]},  # the original qpong_ai network
+    "mlp50": {"type": "mlp", "hidden": [50, 50]},  # the original qsquash_ai network
+    "mlp32": {"type": "mlp", "hidden": [32]},
+    "mlp50_dueling": {"type": "mlp", "hidden": [50, 50], "dueling": True},
+    "conv": {"type": "conv", "conv": [(8, 4, 2), (16, 4, 2)], "hidden": [64]},
+    "conv_dueling": {"type": "conv", "conv": [(8, 4, 2), (16, 4, 2)], "hidden": [64], "dueling": True},
+}
+
+
+def get_architecture(config):
+    if isinstance(config, str):
+        return ARCHITECTURES[config]
+    return config
+
+
+DEFAULT_LR = {"sgd": .2, "adam": .001}
+
+
+def optimizer_settings(config):
+    """(optimizer name, learning rate) of an architecture"""
+    optimizer = config.get("optimizer", "sgd")
+    if optimizer not in DEFAULT_LR:
+        raise ValueError("Unknown optimizer {}".format(optimizer))
+    return optimizer, config.get("lr", DEFAULT_LR[optimizer])
+
+
+def build_model(config, width, height, num_actions=3, backend="keras"):
+    """Build and compile a Q-network taking flattened width*height observations.
+
+    Observations are flattened from [x, y] (pygame.surfarray order), so the conv
+    network reshapes back to (width, height, 1) before convolving. backend="numpy"
+    builds a qmlp.NumpyMLP instead, mlp architectures only.
+    """
+    if backend == "numpy":
+        from qmlp import NumpyMLP
+        return NumpyMLP(config, width, height, num_actions)
+    if backend != "keras":
+        raise ValueError("Unknown backend {}".format(backend))
+
+    # keras is only imported when a model is actually built, so code that just runs
+    # saved weights (qpolicy) doesn't pay for loading it
+    from keras import backend as K
+    from keras.layers import Input, Dense, Reshape, Convolution2D, Flatten, Lambda, merge
+    from keras.models import Model
+    from keras.optimizers import adam, sgd
+
+    config = get_architecture(config)
+    init = config.get("init", "uniform")
+    inputs = Input(shape=(width * height,))
+    x = inputs
+
+    if config["type"] == "conv":
+        x = Reshape((width, height, 1))(x)
+        for filters, kernel, stride in config["conv"]:
+            x = Convolution2D(filters, kernel, kernel, subsample=(stride, stride), border_mode='same',
+                              activation='relu', init=init, dim_ordering='tf')(x)
+        x = Flatten()(x)
+    elif config["type"] != "mlp":
+        raise ValueError("Unknown network type {}".format(config["type"]))
+
+    for size in config["hidden"]:
+        x = Dense(size, activation='relu', init=init)(x)
+
+    if config.get("dueling", False):
+        value = Dense(1, init=init)(x)
+        advantage = Dense(num_actions, init=init)(x)
+        x = merge([value, advantage], mode='concat')
+        # Q(s, a) = V(s) + A(s, a) - mean(A(s, .))
+        outputs = Lambda(lambda va: va[:, :1] + va[:, 1:] - K.mean(va[:, 1:], axis=1, keepdims=True),
+                         output_shape=(num_actions,))(x)
+    else:
+        outputs = Dense(num_actions, init=init)(x)
+
+    model = Model(input=inputs, output=outputs)
+    optimizer, lr = optimizer_settings(config)
+    model.compile((adam if optimizer == "adam" else sgd)(lr=lr), "mse")
+    return model
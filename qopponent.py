@@ -0,0 +1,111 @@
+import math
+import random
+from collections import deque
+
+
+def fold(y, lo, hi):
+    """Reflect an unbounded coordinate back into [lo, hi] like bouncing off both walls"""
+    span = hi - lo
+    if span <= 0:
+        return lo
+    y = (y - lo) % (2 * span)
+    return lo + (y if y <= span else 2 * span - y)
+
+
+def predict_crossing(ball, paddle, hit_direction, height):
+    """Where the centre of the ball will be when it reaches the face of the paddle.
+
+    Straight lines between reflections off the top and bottom walls, the same path
+    Ball.event_step takes. Works on anything with the sge.dsp.Object bbox and velocity
+    attributes, so both SGE objects and qsim boxes. Returns None if the ball is
+    moving away from the paddle.
+    """
+    if ball.xvelocity * hit_direction >= 0:
+        return None
+    if hit_direction == 1:
+        distance = ball.bbox_left - paddle.bbox_right
+    else:
+        distance = paddle.bbox_left - ball.bbox_right
+    frames = max(distance, 0) / abs(ball.xvelocity)
+
+    half_height = ball.bbox_height / 2
+    centre = ball.bbox_top + half_height
+    return fold(centre + ball.yvelocity * frames, half_height, height - half_height)
+
+
+class TrackingController:
+    """Scripted opponent that moves its paddle to where the ball will cross its line.
+
+    reaction_delay  frames between seeing the ball and acting on it
+    speed           fraction of frames the paddle is allowed to move, 1 is full speed
+    error           standard deviation in pixels added to each predicted crossing
+    A strength of reaction_delay=0, speed=1, error=0 is close to unbeatable.
+    """
+
+    def __init__(self, reaction_delay=0, speed=1.0, error=0.0, seed=None):
+        self.reaction_delay = reaction_delay
+        self.speed = speed
+        self.error = error
+        self.rng = random.Random(seed)
+        self.reset()
+
+    def reset(self):
+        self.history = deque(maxlen=self.reaction_delay + 1)
+        self.target_offset = 0.
+        self.approaching = False
+        self.move_budget = 0.
+        self.target = None
+
+    def decide(self, ball, paddle, hit_direction, height):
+        """PlayerActions value (-1, 0 or 1) for this frame"""
+        self.history.append((ball.bbox_top, ball.bbox_left, ball.bbox_right, ball.bbox_height,
+                             ball.xvelocity, ball.yvelocity))
+        seen = _SeenBall(*self.history[0])
+
+        target = predict_crossing(seen, paddle, hit_direction, height)
+        approaching = target is not None
+        if approaching and not self.approaching:
+            # new error for every approach so the miss is consistent within a rally
+            self.target_offset = self.rng.gauss(0, self.error) if self.error > 0 else 0.
+        self.approaching = approaching
+        if target is None:
+            # drift back to the middle while the ball is heading away
+            target = height / 2
+        else:
+            target += self.target_offset
+        self.target = target
+
+        self.move_budget = min(self.move_budget + self.speed, 1.)
+        if self.move_budget < 1.:
+            return 0
+
+        centre = paddle.bbox_top + paddle.bbox_height / 2
+        if abs(target - centre) <= paddle.paddle_speed / 2:
+            return 0
+        self.move_budget -= 1.
+        return 1 if target > centre else -1
+
+    def hold_frames(self, paddle):
+        """Frames the last decision is certain to repeat while the ball flies straight.
+
+        Lets a headless sim fast forward a scripted player between events, only a
+        controller with no reaction delay moving at full speed is predictable so
+        others return 1 and re-decide every frame.
+        """
+        if self.reaction_delay > 0 or self.speed < 1 or self.target is None:
+            return 1
+        centre = paddle.bbox_top + paddle.bbox_height / 2
+        distance = abs(self.target - centre) - paddle.paddle_speed / 2
+        if distance <= 0:
+            return math.inf
+        return max(1, math.ceil(distance / paddle.paddle_speed) - 1)
+
+
+class _SeenBall:
+    def __init__(self, bbox_top, bbox_left, bbox_right, bbox_height, xvelocity, yvelocity):
+        self.bbox_top = bbox_top
+        self.bbox_left = bbox_left
+        self.bbox_right = bbox_right
+        self.bbox_height = bbox_height
+        self.xvelocity = xvelocity
+        self.yvelocity = yvelocity
@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+
+from qmodels import get_architecture
+
+
+class NumpyPolicy:
+    """Forward pass of a qmodels MLP in plain NumPy, for opponents that only ever infer.
+
+    weights is the list model.get_weights() returns, so no Keras is needed to act
+    with a saved network. Conv networks are not supported.
+    """
+
+    def __init__(self, weights, architecture):
+        config = get_architecture(architecture)
+        if config["type"] != "mlp":
+            raise ValueError("NumpyPolicy only runs mlp networks, not {}".format(config["type"]))
+        self.dueling = config.get("dueling", False)
+        weights = [np.asarray(w, dtype=np.float32) for w in weights]
+        self.layers = list(zip(weights[0::2], weights[1::2]))
+        if self.dueling:
+            self.hidden, (self.value, self.advantage) = self.layers[:-2], self.layers[-2:]
+        else:
+            self.hidden, self.output = self.layers[:-1], self.layers[-1]
+
+    def q_values(self, observations):
+        x = np.asarray(observations, dtype=np.float32)
+        for w, b in self.hidden:
+            x = np.maximum(x.dot(w) + b, 0)
+        if self.dueling:
+            value = x.dot(self.value[0]) + self.value[1]
+            advantage = x.dot(self.advantage[0]) + self.advantage[1]
+            return value + advantage - advantage.mean(axis=1, keepdims=True)
+        return x.dot(self.output[0]) + self.output[1]
+
+    def act(self, observation):
+        """Greedy action index for a single (1, n) observation"""
+        return int(np.argmax(self.q_values(observation)[0]))
+
+    def act_batch(self, observations):
+        return np.argmax(self.q_values(observations), axis=1)
+
+
+def save_weights(filename, weights):
+    """Write a list of weight arrays to an .npz, atomically"""
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "wb") as outfile:
+        np.savez(outfile, *weights)
+    os.replace(tmp_filename, filename)
+
+
+def load_weights(filename):
+    with np.load(filename) as data:
+        return [data["arr_{}".format(i)] for i in range(len(data.files))]
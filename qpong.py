@@ -17,29 +17,16 @@ import sge
 
 from qgame import Game, Ball
 
-PADDLE_LENGTH = 16
 
 class Pong(Game):
 
-    def __init__(self, player1, player2, width, height ):
-        super().__init__(width=width, height=height, fps=120, window_text="Pong")
-        self.x_scalar = width / 160
-        self.y_scalar = height / 120
-
+    def __init__(self, player1, player2, width, height, realtime=True, render_every=1, seed=None):
+        super().__init__(width, height, realtime=realtime, render_every=render_every, seed=seed,
+                         window_text="Pong")
         self.player1 = player1
         self.player2 = player2
 
-        self.paddle_sprite = sge.gfx.Sprite(width=3*self.x_scalar, height=PADDLE_LENGTH*self.y_scalar, origin_x=2*self.x_scalar, origin_y=2*self.y_scalar)
-        self.ball_sprite = sge.gfx.Sprite(width=3*self.x_scalar, height=4*self.y_scalar, origin_x=2*self.x_scalar, origin_y=4*self.y_scalar)
-        self.paddle_sprite.draw_rectangle(0, 0, self.paddle_sprite.width, self.paddle_sprite.height,
-                                 fill=sge.gfx.Color("white"))
-        self.ball_sprite.draw_rectangle(0, 0, self.ball_sprite.width, self.ball_sprite.height,
-                               fill=sge.gfx.Color("white"))
-
-        # Load backgrounds
-        layers = [sge.gfx.BackgroundLayer(self.paddle_sprite, sge.game.width / 2, 0, -10000,
-                                      repeat_up=True, repeat_down=True)]
-        self.background = sge.gfx.Background(layers, sge.gfx.Color("black"))
+        self.make_sprites()
 
         sge.game.mouse.visible = False
 
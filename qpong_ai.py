@@ -1,158 +1,106 @@
-import json
-from os import path
-
-import numpy as np
-import sge
-from keras.layers.core import Dense
-from keras.models import Sequential
-from keras.optimizers import sgd
-
-from qgame import Player, PlayerActions, HumanPlayer
-from qpong import Pong
-
-
-class ExperienceReplay(object):
-    def __init__(self, max_memory=30, discount=.9):
-        self.max_memory = max_memory
-        self.memory = list()
-        self.discount = discount
-
-    def remember(self, frame_index, action, reward, game_over):
-        # memory[i] = [state_t, action, reward, state_t+1, game_over]
-        nidx = frame_index
-        cidx = nidx-1
-
-        self.memory.append( [cidx, action, reward, nidx, game_over] )
-        if len(self.memory) > self.max_memory:
-            del self.memory[0]
-
-    def get_batch(self, model, batch_size=10):
-        len_memory = len(self.memory)
-        num_actions = model.output_shape[-1]
-        env_dim = game.shared_visual_memory[0].shape[1]
-        inputs = np.zeros((min(len_memory, batch_size), env_dim)).astype(np.float32)
-        targets = np.zeros((inputs.shape[0], num_actions)).astype(np.float32)
-
-        for i, idx in enumerate(np.random.randint(0, len_memory,
-                                                  size=inputs.shape[0])):
-            cidx, action_t, reward_t, nidx, game_over = self.memory[idx]
-            state_t = game.shared_visual_memory[cidx]
-            state_tp1 = game.shared_visual_memory[nidx]
-
-            inputs[i:i+1] = state_t
-            # There should be no target values for actions not taken.
-            # Thou shalt not correct actions not taken #deep
-            last_predict = model.predict(state_t)[0]
-            curr_predict = model.predict(state_tp1)[0]
-            targets[i] = last_predict
-            Q_sa = np.max(curr_predict)
-
-            if game_over:  # if game_over is True
-                targets[i, action_t] = reward_t
-            else:
-                # reward_t + gamma * max_a' Q(s', a')
-                targets[i, action_t] = reward_t + self.discount * Q_sa
-
-        return inputs, targets
-
-
-class AIPlayer(Player):
-    scored_this_frame = 0
-    loss = 0
-
-    def __init__(self, playerNum):
-        super().__init__(playerNum)
-        # Initialize experience replay object
-        self.exp_replay = ExperienceReplay(max_memory=max_memory)
-
-    def reset(self):
-        self.loss = 0
-        self.exp_replay = ExperienceReplay( max_memory=max_memory)
-
-    def decide_action(self):
-        # we need a few frames to get some visual history
-        if game.shared_visual_memory.frame_index() <=1:
-            return PlayerActions.stay
-        else:
-            # explore the action space with an epsilon random move every now and again
-            if np.random.rand() <= epsilon:
-                action = np.random.randint(-1, 2, size=1)
-                return PlayerActions(action[0])
-            else:
-                q = model.predict(game.shared_visual_memory[game.shared_visual_memory.frame_index()])
-                action = np.argmax(q[0])-1
-
-                return PlayerActions(action)
-
-    def event_step(self, time_passed, delta_mult):
-        action = self.decide_action()
-
-        super().perform_action(action)
-
-        frame_index = game.shared_visual_memory.frame_index()
-
-        if(game.shared_visual_memory.frame_index() >= 2):
-            # store experience
-            self.exp_replay.remember( frame_index,(action.value)+1, self.scored_this_frame, self.game.game_over_flag)
-            self.scored_this_frame = 0
-
-            inputs, targets = self.exp_replay.get_batch(model, batch_size=batch_size)
-
-            self.loss += model.train_on_batch(inputs, targets)
-
-        super().event_step(time_passed, delta_mult)
-
-    def scored(self, me = True):
-        super().scored(me)
-
-        if me:
-            # no gain if we nobody was involved
-            if game.bounce_count == 0:
-                return
-            self.scored_this_frame = 1
-        else:
-            self.scored_this_frame = -1
-
-if __name__ == '__main__':
-    # parameters
-    epsilon = .2  # exploration
-    num_actions = 3  # [move_left, stay, move_right]
-    epoch = 100
-    max_memory = 100
-    batch_size = 20
-
-    game_width = 80
-    game_height = 60
-    hidden_size = 100
-
-    model = Sequential()
-    model.add(Dense(hidden_size, input_dim = game_width*game_height, activation = 'relu', init = 'uniform'))
-    model.add(Dense(hidden_size, activation = 'relu',init = 'uniform'))
-    model.add(Dense(num_actions, init = 'uniform'))
-    model.compile(sgd(lr=.2), "mse")
-
-    # If you want to continue training from a previous model, just uncomment the line bellow
-    if path.isfile("qpong_ai.h5"):
-        model.load_weights("qpong_ai.h5")
-
-    p1 = HumanPlayer(1)
-    p2 = AIPlayer(2)
-
-    for e in range(epoch):
-        game = Pong(p1, p2, game_width, game_height)
+import argparse
+
+from qleague import League
+from qopponent import TrackingController
+from qtrain import TrainConfig, DQNAgent, Trainer
+
+
+def train(config, p1=None, realtime=False, render_every=10, record_episodes=False,
+          league_dir=None, snapshot_every=10, league_matches=4, processes=None, callback=None):
+    """Train an AIPlayer as player 2, against a scripted opponent unless p1 is given.
+
+    With a league_dir the learner is frozen into the league every snapshot_every epochs
+    and rated against league_matches sampled snapshots in a process pool, once the
+    league has snapshots each episode is played against a sampled one.
+    """
+    # SGE and pygame are only loaded once a game is actually going to be played
+    import sge
+    from qai import AIPlayer, PolicyPlayer
+    from qgame import ScriptedPlayer
+    from qpong import Pong
+    from qrecord import EpisodeLog, recording_seed
+    from qview import FrameBroadcaster
+
+    agent = DQNAgent(config)
+    if p1 is None:
+        p1 = ScriptedPlayer(1, TrackingController(reaction_delay=6, speed=.6, error=4, seed=config.seed))
+    p2 = AIPlayer(2, agent)
+    league = None
+    if league_dir is not None:
+        league = League(league_dir, config.width, config.height, seed=config.seed)
+
+    def snapshot(e):
+        name = "epoch{:04d}".format(e)
+        league.add_snapshot(name, agent.model.get_weights(), config.architecture)
+        for opponent, score in league.play_round(name, league.sample(league_matches, exclude=name),
+                                                 processes=processes):
+            print("League {} vs {} | Won {:.2f}".format(name, opponent, score))
+        print("League rating {:.0f}".format(league.snapshots[name]["rating"]))
+
+    def run_episode(e, seed):
+        if record_episodes:
+            seed = recording_seed(seed)
+        opponent = p1
+        if league is not None and league.snapshots:
+            opponent = PolicyPlayer(1, league.policy(league.sample()[0]))
+
+        game = Pong(opponent, p2, config.width, config.height, realtime=realtime, render_every=render_every,
+                    seed=seed)
         game.fullscreen = False
+        game.frame_broadcaster = broadcaster
+        if record_episodes:
+            game.episode_log = EpisodeLog(seed, config.width, config.height)
 
         sge.game.start()
         # game is over
-        print( "P1 Score {} P2 Score {}".format(game.player1.score, game.player2.score))
-        if isinstance(p1, AIPlayer) and isinstance(p2, AIPlayer):
-            print("Epoch {:03d}/999 | Loss P1 {:.4f} | Loss P2 {:.4f}".format(e, game.player1.loss, game.player2.loss))
-        if p1 is AIPlayer:
-            p1.reset()
-        if p2 is AIPlayer:
-            p2.reset()
-
-    # Save trained model weights and architecture, this will be used by the visualization code
-    model.save_weights("qpong_ai.h5", overwrite=True)
-    with open("qpong_ai.json", "w") as outfile:
-        json.dump(model.to_json(), outfile)
+        if record_episodes:
+            game.episode_log.finish(game)
+            game.episode_log.save("qpong_ai_episode_{:03d}.json".format(e))
+        stats = {"score": p2.score, "opponent_score": opponent.score}
+
+        if league is not None and (e + 1) % snapshot_every == 0:
+            snapshot(e)
+        return stats
+
+    broadcaster = FrameBroadcaster.for_config(config)
+    try:
+        return Trainer(config, [agent], run_episode, callback).run()
+    finally:
+        if broadcaster is not None:
+            broadcaster.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train a DQN Pong player")
+    parser.add_argument("--epochs", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--human", action="store_true",
+                        help="play against a human on w/s instead of the scripted opponent")
+    parser.add_argument("--league", metavar="DIR", default=None, help="self-play against frozen snapshots kept in DIR")
+    parser.add_argument("--view", metavar="NAME", default=None, help="let qview.py NAME watch training")
+    parser.add_argument("--backend", choices=("keras", "numpy"), default="keras",
+                        help="numpy trains with qmlp instead of Keras")
+    args = parser.parse_args()
+
+    # parameters
+    config = TrainConfig(epsilon=.2,
+                         epoch=args.epochs,
+                         max_memory=100,
+                         batch_size=20,
+                         architecture="mlp100",
+                         width=80,
+                         height=60,
+                         backend=args.backend,
+                         seed=args.seed,
+                         view_name=args.view,
+                         weights_file="qpong_ai.h5",
+                         checkpoint_dir="qpong_ai_checkpoints")
+
+    if args.human:
+        from qgame import HumanPlayer
+
+        # a human is playing on w/s so keep real time pacing and draw every frame
+        train(config, p1=HumanPlayer(1), realtime=True, render_every=1)
+    else:
+        # the scripted opponent needs nobody at the keys, run uncapped and only draw every few frames
+        train(config, realtime=False, render_every=10, league_dir=args.league)
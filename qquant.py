@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""int8 export of qmodels MLPs, a policy with a quarter of the weight memory.
+
+Dense weights are quantized to int8 with one scale per output channel and the
+forward pass accumulates in integers. Screens are 8 bit and almost all black,
+so the first layer only gathers the weight rows of lit pixels. Hidden activations
+are requantized per observation after the ReLU, and only biases and the final
+rescale are float.
+
+It saves memory, not time. NumPy has no int8 kernels, the casts and integer
+gathers cost more than the smaller weights save, and QuantizedPolicy acts
+slower than the float32 NumpyPolicy (see python3 qbench.py quantized). The
+export is for keeping many league snapshots around or for a runtime with int8
+kernels to load.
+
+    python3 qquant.py qpong_ai.npz mlp100 qpong_ai_int8.npz
+
+checks the argmax agreement with the float network on frames recorded from
+headless games, prints the memory and latency of both and saves the export.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from qmodels import get_architecture
+from qpolicy import NumpyPolicy, load_weights
+
+INPUT_LEVELS = 255  # observations are 8 bit screens scaled to 0-1
+ACTIVATION_LEVELS = 127
+EXACT_INPUTS = 2 ** 24 // (127 * 127)
+
+
+def quantize_layer(w, b):
+    """(int8 weights, per output channel scales, float32 bias) for a Dense layer"""
+    w = np.asarray(w, dtype=np.float32)
+    scales = np.abs(w).max(axis=0) / 127
+    scales[scales == 0] = 1
+    return np.rint(w / scales).astype(np.int8), scales.astype(np.float32), np.asarray(b, dtype=np.float32)
+
+
+class QuantizedPolicy:
+    """Same interface as qpolicy.NumpyPolicy, with int8 weights and integer accumulation"""
+
+    def __init__(self, layers, dueling=False):
+        self.dueling = dueling
+        self.layers = layers
+        self.num_hidden = len(layers) - (2 if dueling else 1)
+        if self.num_hidden < 1:
+            raise ValueError("QuantizedPolicy needs at least one hidden layer")
+        # NumPy has no fast int8 matmul. Products of two int8 values summed over fewer than
+        # EXACT_INPUTS inputs stay below 2 ** 24, so float32 BLAS on the integer values
+        # accumulates them exactly. The input layer only ever widens its lit rows.
+        self.wide = [None] + [w.astype(np.float32 if len(w) <= EXACT_INPUTS else np.int32)
+                              for w, _, _ in layers[1:]]
+
+    @classmethod
+    def from_weights(cls, weights, architecture):
+        """Quantize a model.get_weights() list"""
+        config = get_architecture(architecture)
+        if config["type"] != "mlp":
+            raise ValueError("Only mlp networks can be quantized, not {}".format(config["type"]))
+        layers = [quantize_layer(w, b) for w, b in zip(weights[0::2], weights[1::2])]
+        return cls(layers, config.get("dueling", False))
+
+    def nbytes(self):
+        return sum(w.nbytes + scales.nbytes + b.nbytes for w, scales, b in self.layers)
+
+    def _input_layer(self, observations):
+        observations = np.asarray(observations, dtype=np.float32)
+        # only lit pixels contribute, sum their weight rows per observation
+        if len(observations) == 1:
+            columns = np.flatnonzero(observations[0])
+            values = np.rint(observations[0, columns] * INPUT_LEVELS).astype(np.int32)
+            return values.dot(self.layers[0][0][columns].astype(np.int32))[np.newaxis], 1 / INPUT_LEVELS
+        rows, columns = np.nonzero(observations)
+        values = np.rint(observations[rows, columns] * INPUT_LEVELS).astype(np.int32)
+        lit = self.layers[0][0][columns].astype(np.int32)
+        lit *= values[:, np.newaxis]
+        counts = np.bincount(rows, minlength=len(observations))
+        accumulated = np.zeros((len(observations), lit.shape[1]), dtype=np.int32)
+        if len(rows):
+            starts = np.cumsum(counts) - counts
+            accumulated[counts > 0] = np.add.reduceat(lit, starts[counts > 0], axis=0)
+        return accumulated, 1 / INPUT_LEVELS
+
+    def _rescale(self, accumulated, input_scales, layer):
+        _, scales, b = layer  # accumulated is in units of input scale * weight scale
+        return accumulated * (input_scales * scales) + b
+
+    def _requantize(self, y):
+        y = np.maximum(y, 0)
+        peak = y.max(axis=1, keepdims=True)
+        scales = np.where(peak > 0, peak / ACTIVATION_LEVELS, 1)
+        return np.rint(y / scales).astype(np.float32), scales
+
+    def q_values(self, observations):
+        accumulated, input_scales = self._input_layer(observations)
+        y = self._rescale(accumulated, input_scales, self.layers[0])
+        for n in range(1, self.num_hidden):
+            x, input_scales = self._requantize(y)
+            y = self._rescale(x.dot(self.wide[n]), input_scales, self.layers[n])
+        x, input_scales = self._requantize(y)
+        heads = [self._rescale(x.dot(self.wide[n]), input_scales, self.layers[n])
+                 for n in range(self.num_hidden, len(self.layers))]
+        if self.dueling:
+            value, advantage = heads
+            return value + advantage - advantage.mean(axis=1, keepdims=True)
+        return heads[0]
+
+    def act(self, observation):
+        """Greedy action index for a single (1, n) observation"""
+        return int(np.argmax(self.q_values(observation)[0]))
+
+    def act_batch(self, observations):
+        return np.argmax(self.q_values(observations), axis=1)
+
+
+def save_quantized(filename, policy):
+    arrays = {"dueling": np.array(policy.dueling)}
+    for n, (w, scales, b) in enumerate(policy.layers):
+        arrays.update({"w{}".format(n): w, "scales{}".format(n): scales, "b{}".format(n): b})
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "wb") as outfile:
+        np.savez(outfile, **arrays)
+    os.replace(tmp_filename, filename)
+
+
+def load_quantized(filename):
+    with np.load(filename) as data:
+        count = sum(1 for name in data.files if name.startswith("w"))
+        layers = [(data["w{}".format(n)], data["scales{}".format(n)], data["b{}".format(n)]) for n in range(count)]
+        return QuantizedPolicy(layers, bool(data["dueling"]))
+
+
+def agreement(policy, other, observations):
+    """Fraction of observations both policies pick the same action for"""
+    return float(np.mean(policy.act_batch(observations) == other.act_batch(observations)))
+
+
+def record_frames(width=80, height=60, games=20, seed=0, max_frames=2000):
+    """Frames from headless games between scripted players, what a deployed policy would see"""
+    from qopponent import TrackingController
+    from qsim import PongSim
+
+    frames = list()
+    for game in range(games):
+        sim = PongSim(width, height, seed=seed + game)
+        controllers = [TrackingController(reaction_delay=6, speed=.6, error=4, seed=seed + game * 2 + n)
+                       for n in range(2)]
+        while not sim.game_over_flag and sim.frame_count < max_frames:
+            frames.append(sim.observe()[0])
+            sim.step(*[c.decide(sim.ball, p.moved(sim.height), p.hit_direction, sim.height)
+                       for c, p in zip(controllers, sim.players)])
+    return np.array(frames, dtype=np.float32)
+
+
+def latency(policy, observation, repeat=1000):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        policy.act(observation)
+    return (time.perf_counter() - start) / repeat
+
+
+def compare(float_policy, quantized, frames):
+    """Rows of (name, memory kB, act latency us, batch latency us) for both policies"""
+    float_bytes = sum(w.nbytes + b.nbytes for w, b in float_policy.layers)
+    batch = frames[:32]
+    rows = list()
+    for name, policy, nbytes in (("float32", float_policy, float_bytes),
+                                 ("int8", quantized, quantized.nbytes())):
+        start = time.perf_counter()
+        for _ in range(100):
+            policy.act_batch(batch)
+        batch_latency = (time.perf_counter() - start) / 100
+        rows.append([name, "{:.1f}".format(nbytes / 1024), "{:.1f}".format(latency(policy, frames[:1]) * 1e6),
+                     "{:.1f}".format(batch_latency * 1e6)])
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Quantize a trained MLP to int8 and check it still agrees")
+    parser.add_argument("weights", help=".npz from qpolicy.save_weights or a Keras .h5")
+    parser.add_argument("architecture")
+    parser.add_argument("output")
+    parser.add_argument("--width", type=int, default=80)
+    parser.add_argument("--height", type=int, default=60)
+    parser.add_argument("--threshold", type=float, default=.98, help="minimum argmax agreement")
+    args = parser.parse_args()
+
+    if args.weights.endswith(".h5"):
+        from qmodels import build_model
+        model = build_model(args.architecture, args.width, args.height)
+        model.load_weights(args.weights)
+        weights = model.get_weights()
+    else:
+        weights = load_weights(args.weights)
+
+    float_policy = NumpyPolicy(weights, args.architecture)
+    quantized = QuantizedPolicy.from_weights(weights, args.architecture)
+    frames = record_frames(args.width, args.height)
+    agreed = agreement(float_policy, quantized, frames)
+    print("Argmax agreement {:.4f} over {} frames".format(agreed, len(frames)))
+    from qbench import print_table
+    print_table(["weights", "memory kB", "act us", "batch 32 us"], compare(float_policy, quantized, frames))
+    print("int8 only saves memory here, NumPy has no int8 kernels so it acts slower than float32")
+    if agreed < args.threshold:
+        raise SystemExit("Agreement is below {}, not saving".format(args.threshold))
+    save_quantized(args.output, quantized)
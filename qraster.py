@@ -0,0 +1,66 @@
+import numpy as np
+
+
+def draw_box(canvas, left, top, width, height, value=1.0):
+    """Fill an axis aligned box on a (width, height) canvas, clipped to the canvas
+    """
+    x0 = max(int(round(left)), 0)
+    y0 = max(int(round(top)), 0)
+    x1 = min(int(round(left + width)), canvas.shape[0])
+    y1 = min(int(round(top + height)), canvas.shape[1])
+    if x1 > x0 and y1 > y0:
+        canvas[x0:x1, y0:y1] = value
+
+
+def rasterise(width, height, boxes, net=None):
+    """Draw the world the same way the screen does, white boxes on black.
+
+    The canvas is indexed [x, y] like pygame.surfarray so the flattened result matches
+    the screenshot based observation. boxes is a list of (left, top, width, height),
+    net is an optional (left, width) full height column.
+    """
+    canvas = np.zeros((width, height))
+    if net is not None:
+        draw_box(canvas, net[0], 0, net[1], height)
+    for box in boxes:
+        draw_box(canvas, *box)
+    return canvas
+
+
+def mirror(observation, width, height):
+    """Flip a flattened observation left to right, so a network trained as the right
+    hand player can play from the left"""
+    return observation.reshape((width, height))[::-1].reshape((1, -1))
+
+
+def resample_matrix(size, new_size):
+    """(new_size, size) weights averaging the source pixels each new pixel covers"""
+    edges = np.arange(new_size + 1) * (size / new_size)
+    left = np.arange(size)
+    overlap = (np.minimum(edges[1:, None], left[None, :] + 1) - np.maximum(edges[:-1, None], left[None, :]))
+    weights = np.maximum(overlap, 0)
+    return (weights / weights.sum(axis=1, keepdims=True)).astype(np.float32)
+
+
+class Resampler:
+    """Resamples flattened (n, width * height) observations to another resolution.
+
+    Each output pixel is the average of the input area it covers, so a model with
+    a fixed input size can watch a game at any resolution, e.g. trained at 40x30 and
+    evaluated at 80x60.
+    """
+
+    def __init__(self, width, height, new_width, new_height):
+        self.width = width
+        self.height = height
+        self.new_width = new_width
+        self.new_height = new_height
+        self.x_weights = resample_matrix(width, new_width)
+        self.y_weights = resample_matrix(height, new_height).T.copy()
+
+    def __call__(self, observations):
+        if (self.width, self.height) == (self.new_width, self.new_height):
+            return observations
+        canvases = np.asarray(observations, dtype=np.float32).reshape((-1, self.width, self.height))
+        resampled = np.matmul(np.matmul(self.x_weights, canvases), self.y_weights)
+        return resampled.reshape((len(canvases), -1))
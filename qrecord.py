@@ -0,0 +1,97 @@
+import json
+import random
+
+
+class EpisodeLog:
+    """Seed plus every action taken, enough to re-simulate an episode exactly.
+
+    Set game.episode_log to one of these before sge.game.start() and every
+    Player.perform_action is recorded, call finish() once the game is over to
+    fingerprint the final state so a replay can check it got the same result.
+    """
+
+    def __init__(self, seed, width, height):
+        self.seed = seed
+        self.width = width
+        self.height = height
+        self.actions = dict()
+        self.result = None
+
+    def record(self, player_num, action):
+        self.actions.setdefault(player_num, list()).append(action.value)
+
+    def player_actions(self, player_num):
+        return self.actions.get(player_num, list())
+
+    def finish(self, game):
+        self.result = fingerprint(game)
+        return self.result
+
+    def save(self, filename):
+        with open(filename, "w") as outfile:
+            json.dump({"seed": self.seed,
+                       "width": self.width,
+                       "height": self.height,
+                       "actions": {str(k): v for k, v in self.actions.items()},
+                       "result": self.result}, outfile)
+
+    @staticmethod
+    def load(filename):
+        with open(filename, "r") as infile:
+            data = json.load(infile)
+        log = EpisodeLog(data["seed"], data["width"], data["height"])
+        log.actions = {int(k): v for k, v in data["actions"].items()}
+        log.result = data["result"]
+        return log
+
+
+def recording_seed(seed):
+    """Seed for an episode that is going to be recorded, an unseeded one gets a random seed
+    because the log can only be replayed from the seed the game actually played
+    """
+    return random.randrange(2 ** 31) if seed is None else seed
+
+
+def fingerprint(game):
+    """Final state of a game, used to compare a recorded run with its replay"""
+    scores = [game.player1.score]
+    if type(game.player2) != int: scores.append(game.player2.score)
+    return {"frames": game.frame_count,
+            "scores": scores,
+            "ball": [game.ball.x, game.ball.y]}
+
+
+def replay(log, make_game):
+    """Re-simulate a recorded episode.
+
+    make_game(log) should build the game with seed=log.seed and qgame.LogPlayer
+    players reading from log (qai.SquashLogPlayer for Squash, which scores like
+    the qai.SquashAIPlayer it recorded), returns (replayed fingerprint, matches recording)
+    """
+    import sge
+
+    game = make_game(log)
+    sge.game.start()
+    result = fingerprint(game)
+    return result, result == log.result
+
+
+if __name__ == '__main__':
+    import sys
+
+    from qai import SquashLogPlayer
+    from qgame import LogPlayer
+
+    # replay an episode written by qpong_ai.py or qsquash_ai.py with record_episodes = True
+    log = EpisodeLog.load(sys.argv[1])
+
+    def make_game(log):
+        if len(log.actions) == 2:
+            from qpong import Pong
+            return Pong(LogPlayer(1, log), LogPlayer(2, log), log.width, log.height, realtime=False, seed=log.seed)
+        else:
+            from qsquash import Squash
+            return Squash(SquashLogPlayer(1, log), log.width, log.height, realtime=False, seed=log.seed)
+
+    result, matches = replay(log, make_game)
+    print("Replayed {} | Recorded {} | {}".format(result, log.result, "Match" if matches else "MISMATCH"))
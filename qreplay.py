@@ -0,0 +1,178 @@
+"""Experience replay in shared memory, one shard per writer process.
+
+Each actor process owns a ReplayShard and is its only writer, so writes need no
+lock. Learners in any process attach with ReplaySampler by name and sample
+batches straight out of shared memory, no frames go through pipes.
+
+Every slot has a version counter used as a seqlock. The writer makes it odd,
+writes the transition, then makes it even again. A sampler reads the version,
+copies the slot and reads the version again, and a slot that was odd or changed
+in between is thrown away and sampled again, so a half written transition is
+never returned. This relies on stores becoming visible in order, which x86 does.
+
+Observations are screens with values 0-1 and are stored as uint8, 0-255, and
+scaled back to float32 when sampled. The shard below takes about 0.96 GB, it would
+be 3.8 GB as float32. Segments have fixed names, a shard left behind by a crashed
+run is replaced with replace=True (see qshm.SharedSegment).
+
+    shard = ReplayShard("qpong_replay", 0, capacity=100000, observation_size=4800, n_step=3)
+    shard.remember(state_t, action, reward, state_tp1, game_over)
+    ...
+    sampler = ReplaySampler("qpong_replay", num_shards=4)
+    inputs, targets = sampler.get_batch(model, 32)
+"""
+import numpy as np
+
+from qshm import Layout, SharedSegment
+from qtrain import NStepReturns, q_targets
+
+HEADER_FIELDS = 3  # capacity, observation size, transitions written
+
+
+def shard_name(name, shard):
+    return "{}_{}".format(name, shard)
+
+
+def shard_layout(capacity, observation_size):
+    return Layout([("header", (HEADER_FIELDS,), np.int64),
+                   ("versions", (capacity,), np.int64),
+                   ("states", (capacity, observation_size), np.uint8),
+                   ("next_states", (capacity, observation_size), np.uint8),
+                   ("actions", (capacity,), np.int32),
+                   ("rewards", (capacity,), np.float32),
+                   ("discounts", (capacity,), np.float32),
+                   ("game_overs", (capacity,), np.bool_)])
+
+
+class _Shard:
+    fields = ("header", "versions", "states", "next_states", "actions", "rewards", "discounts", "game_overs")
+
+    def _map(self, segment, capacity, observation_size):
+        self.segment = segment
+        self.capacity = capacity
+        self.observation_size = observation_size
+        for name, array in shard_layout(capacity, observation_size).arrays(segment).items():
+            setattr(self, name, array)
+
+    def _unmap(self):
+        # the views have to go before the mapping can be closed
+        for name in self.fields:
+            setattr(self, name, None)
+        self.segment.close()
+
+    def __len__(self):
+        return min(int(self.header[2]), self.capacity)
+
+
+class ReplayShard(_Shard):
+    """The single writer of one shard, a ring of capacity transitions.
+
+    remember() takes one step transitions, n_step of them are summed into each stored
+    transition as they arrive, see qtrain.NStepReturns.
+    """
+
+    def __init__(self, name, shard, capacity, observation_size, n_step=1, discount=.9, replace=False):
+        segment = SharedSegment(shard_name(name, shard), shard_layout(capacity, observation_size).size, create=True,
+                                replace=replace)
+        self._map(segment, capacity, observation_size)
+        self.header[:] = (capacity, observation_size, 0)
+        self.count = 0
+        self.n_step = NStepReturns(n_step, discount)
+
+    def remember(self, state_t, action, reward, state_tp1, game_over, truncated=False):
+        for transition in self.n_step.add(state_t, action, reward, state_tp1, game_over, truncated):
+            self.write(*transition)
+
+    def write(self, state_t, action, ret, state_tpn, game_over, discount):
+        slot = self.count % self.capacity
+        self.versions[slot] += 1  # odd, being written
+        self.states[slot] = np.rint(np.ravel(state_t) * 255)
+        self.next_states[slot] = np.rint(np.ravel(state_tpn) * 255)
+        self.actions[slot] = action
+        self.rewards[slot] = ret
+        self.discounts[slot] = discount
+        self.game_overs[slot] = game_over
+        self.versions[slot] += 1  # even, readable
+        self.count += 1
+        self.header[2] = self.count
+
+    def close(self):
+        """Stop sharing the shard, samplers already attached keep their mapping"""
+        self._unmap()
+        self.segment.unlink()
+
+
+class _AttachedShard(_Shard):
+    def __init__(self, name):
+        segment = SharedSegment(name)
+        capacity, observation_size = segment.array(0, (2,), np.int64)
+        self._map(segment, int(capacity), int(observation_size))
+
+
+class ReplaySampler:
+    """Uniform samples across every shard of a replay, from any process"""
+
+    def __init__(self, name, num_shards, rng=np.random, max_retries=10):
+        self.shards = [_AttachedShard(shard_name(name, shard)) for shard in range(num_shards)]
+        self.rng = rng
+        self.max_retries = max_retries
+        self.retries = 0
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def _pick(self, count, sizes):
+        shards = np.searchsorted(np.cumsum(sizes), self.rng.randint(0, sizes.sum(), size=count), side="right")
+        slots = (self.rng.random_sample(count) * sizes[shards]).astype(np.int64)
+        return shards, slots
+
+    def sample(self, batch_size):
+        """(states, actions, returns, next_states, game_overs, discounts) of up to batch_size transitions"""
+        sizes = np.array([len(shard) for shard in self.shards], dtype=np.int64)
+        count = min(int(sizes.sum()), batch_size)
+        observation_size = self.shards[0].observation_size
+        states = np.empty((count, observation_size), dtype=np.float32)
+        next_states = np.empty((count, observation_size), dtype=np.float32)
+        actions = np.empty(count, dtype=np.int32)
+        rewards = np.empty(count, dtype=np.float32)
+        discounts = np.empty(count, dtype=np.float32)
+        game_overs = np.empty(count, dtype=np.bool_)
+
+        rows = np.arange(count)
+        for _ in range(self.max_retries + 1):
+            if not len(rows):
+                break
+            shards, slots = self._pick(len(rows), sizes)
+            torn = np.zeros(len(rows), dtype=np.bool_)
+            for n, shard in enumerate(self.shards):
+                mask = shards == n
+                if not mask.any():
+                    continue
+                index, slot = rows[mask], slots[mask]
+                before = shard.versions[slot]
+                states[index] = shard.states[slot]
+                next_states[index] = shard.next_states[slot]
+                actions[index] = shard.actions[slot]
+                rewards[index] = shard.rewards[slot]
+                discounts[index] = shard.discounts[slot]
+                game_overs[index] = shard.game_overs[slot]
+                after = shard.versions[slot]
+                torn[mask] = (before != after) | (before % 2 == 1)
+            self.retries += int(torn.sum())
+            rows = rows[torn]
+        if len(rows):
+            raise RuntimeError("Replay slots kept changing while being sampled, is the capacity too small?")
+        states *= 1 / 255
+        next_states *= 1 / 255
+        return states, actions, rewards, next_states, game_overs, discounts
+
+    def get_batch(self, model, batch_size=10, target_model=None, double=False):
+        """Inputs and Q targets, the same as qtrain.ExperienceReplay.get_batch"""
+        states, actions, rewards, next_states, game_overs, discounts = self.sample(batch_size)
+        return states, q_targets(model, states, actions, rewards, next_states, ~game_overs, discounts,
+                                 target_model, double)
+
+    def close(self):
+        for shard in self.shards:
+            shard._unmap()
+        self.shards = list()
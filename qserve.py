@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""Batched inference for many game processes, one model behind a Unix socket.
+
+Game processes connect with InferenceClient (or RemotePolicy, a drop in for
+qpolicy.NumpyPolicy) and send one observation at a time. The server collects
+requests until it has max_batch of them or the oldest has waited max_latency
+seconds, runs one forward pass and replies with the action and Q-values.
+The weights file is watched and reloaded when the learner publishes new weights.
+The server can start before the first weights are published, requests queue up
+until they appear.
+
+    python3 qserve.py /tmp/qpong.sock qpong_ai.npz mlp100
+"""
+import os
+import selectors
+import socket
+import struct
+import sys
+import time
+
+import numpy as np
+
+from qpolicy import NumpyPolicy, load_weights
+
+REQUEST_HEADER = struct.Struct("<I")  # observation byte count, float32 observation follows
+REPLY_HEADER = struct.Struct("<BB")  # action, number of float32 Q-values that follow
+WEIGHTS_RETRY = .05  # seconds between looks for the weights file while there are none yet
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else 0.
+
+
+class _Connection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+
+
+class InferenceServer:
+    def __init__(self, socket_path, weights_file, architecture, max_batch=64, max_latency=.002,
+                 reload_interval=1.):
+        self.socket_path = socket_path
+        self.weights_file = weights_file
+        self.architecture = architecture
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.reload_interval = reload_interval
+        self.policy = None
+        self.weights_mtime = None
+        self.last_reload_check = 0
+        self.pending = list()  # (arrival time, connection, observation)
+        self.latencies = list()
+        self.batch_sizes = list()
+        self.reloads = 0
+        self.running = False
+        self.reload_weights()
+
+    def reload_weights(self):
+        """Load the weights if the learner has published new ones, True if they changed"""
+        self.last_reload_check = time.perf_counter()
+        try:
+            mtime = os.stat(self.weights_file).st_mtime
+        except FileNotFoundError:
+            return False
+        if mtime == self.weights_mtime:
+            return False
+        self.policy = NumpyPolicy(load_weights(self.weights_file), self.architecture)
+        self.weights_mtime = mtime
+        self.reloads += 1
+        return True
+
+    def serve_forever(self, stats_interval=10.):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.listen(128)
+        listener.setblocking(False)
+        selector = selectors.DefaultSelector()
+        selector.register(listener, selectors.EVENT_READ)
+
+        self.running = True
+        last_stats = time.perf_counter()
+        try:
+            while self.running:
+                timeout = None
+                if self.policy is None:
+                    timeout = WEIGHTS_RETRY
+                elif self.pending:
+                    timeout = max(self.pending[0][0] + self.max_latency - time.perf_counter(), 0)
+                elif self.reload_interval:
+                    timeout = self.reload_interval
+                for key, _ in selector.select(timeout):
+                    if key.fileobj is listener:
+                        sock, _ = listener.accept()
+                        sock.setblocking(False)
+                        selector.register(sock, selectors.EVENT_READ, _Connection(sock))
+                    else:
+                        self._read(selector, key.data)
+
+                now = time.perf_counter()
+                if self.policy is None or (self.reload_interval and
+                                           now - self.last_reload_check >= self.reload_interval):
+                    self.reload_weights()
+                # without weights requests stay queued until the learner publishes some
+                if self.policy is not None and self.pending and (len(self.pending) >= self.max_batch or
+                                                                 now - self.pending[0][0] >= self.max_latency):
+                    self._run_batch()
+                if stats_interval and now - last_stats >= stats_interval:
+                    print(self.format_stats())
+                    last_stats = now
+        finally:
+            selector.close()
+            listener.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def stop(self):
+        self.running = False
+
+    def _read(self, selector, connection):
+        try:
+            data = connection.sock.recv(1 << 16)
+        except (BlockingIOError, InterruptedError):
+            return
+        except ConnectionError:
+            data = b""
+        if not data:
+            selector.unregister(connection.sock)
+            connection.sock.close()
+            self.pending = [p for p in self.pending if p[1] is not connection]
+            return
+
+        connection.buffer += data
+        arrival = time.perf_counter()
+        while len(connection.buffer) >= REQUEST_HEADER.size:
+            size, = REQUEST_HEADER.unpack_from(connection.buffer)
+            if len(connection.buffer) < REQUEST_HEADER.size + size:
+                break
+            start = REQUEST_HEADER.size
+            observation = np.frombuffer(bytes(connection.buffer[start:start + size]), dtype=np.float32)
+            del connection.buffer[:start + size]
+            self.pending.append((arrival, connection, observation))
+
+    def _run_batch(self):
+        batch = self.pending[:self.max_batch]
+        self.pending = self.pending[self.max_batch:]
+        q = self.policy.q_values(np.vstack([observation for _, _, observation in batch]))
+        actions = np.argmax(q, axis=1)
+        q = q.astype(np.float32)
+
+        for (arrival, connection, _), action, q_row in zip(batch, actions, q):
+            reply = REPLY_HEADER.pack(int(action), len(q_row)) + q_row.tobytes()
+            try:
+                connection.sock.sendall(reply)
+            except (BlockingIOError, ConnectionError):
+                continue
+        done = time.perf_counter()
+        self.latencies.extend(done - arrival for arrival, _, _ in batch)
+        self.batch_sizes.append(len(batch))
+
+    def stats(self):
+        latencies = self.latencies
+        return {"requests": len(latencies),
+                "batches": len(self.batch_sizes),
+                "mean_batch": float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.,
+                "max_batch": max(self.batch_sizes) if self.batch_sizes else 0,
+                "latency_p50_ms": percentile(latencies, 50) * 1000,
+                "latency_p99_ms": percentile(latencies, 99) * 1000,
+                "reloads": self.reloads}
+
+    def format_stats(self):
+        return ("Requests {requests} | Batches {batches} | Mean batch {mean_batch:.1f} | Max batch {max_batch} | "
+                "Latency p50 {latency_p50_ms:.3f}ms p99 {latency_p99_ms:.3f}ms | Reloads {reloads}"
+                .format(**self.stats()))
+
+
+class InferenceClient:
+    """Blocking client, one request in flight at a time per connection"""
+
+    def __init__(self, socket_path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.latencies = list()
+
+    def request(self, observation):
+        """Returns (action index, Q-values)"""
+        payload = np.ascontiguousarray(observation, dtype=np.float32).tobytes()
+        start = time.perf_counter()
+        self.sock.sendall(REQUEST_HEADER.pack(len(payload)) + payload)
+        action, count = REPLY_HEADER.unpack(self._recv(REPLY_HEADER.size))
+        q = np.frombuffer(self._recv(4 * count), dtype=np.float32)
+        self.latencies.append(time.perf_counter() - start)
+        return action, q
+
+    def _recv(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Inference server closed the connection")
+            data += chunk
+        return bytes(data)
+
+    def close(self):
+        self.sock.close()
+
+
+class RemotePolicy:
+    """Acts through an InferenceServer with the same interface as qpolicy.NumpyPolicy"""
+
+    def __init__(self, socket_path):
+        self.client = InferenceClient(socket_path)
+
+    def act(self, observation):
+        return self.client.request(observation)[0]
+
+    def q_values(self, observations):
+        return np.vstack([self.client.request(observation)[1] for observation in observations])
+
+
+if __name__ == '__main__':
+    socket_path, weights_file, architecture = sys.argv[1:4]
+    InferenceServer(socket_path, weights_file, architecture).serve_forever()
@@ -0,0 +1,86 @@
+"""Named shared memory segments that other processes attach to by name.
+
+A segment is a file in /dev/shm (tmpfs, so it never touches the disk) mapped into
+each process, the same thing multiprocessing.shared_memory does on Linux. That module
+needs Python 3.8, and its resource tracker unlinks segments when any process that
+merely attached exits, so segments here are mapped directly and only their creator
+unlinks them.
+"""
+import mmap
+import os
+import tempfile
+
+import numpy as np
+
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def segment_path(name):
+    return os.path.join(SHM_DIR, name)
+
+
+class SharedSegment:
+    """size bytes of shared memory called name, created or attached to.
+
+    Creating fails with FileExistsError while a segment of that name exists. One
+    left behind by a run that crashed before unlinking it is removed first with
+    replace=True, so only pass that when no live process can own the name.
+    """
+
+    def __init__(self, name, size=0, create=False, replace=False):
+        self.name = name
+        self.path = segment_path(name)
+        self.owner = create
+        if create:
+            if replace:
+                self.unlink()
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_RDWR, 0o600)
+            except FileExistsError:
+                raise FileExistsError("Shared memory segment {} already exists, remove it or pass replace=True if "
+                                      "it is left over from a crashed run".format(self.path))
+        else:
+            fd = os.open(self.path, os.O_RDWR)
+            size = os.fstat(fd).st_size
+        try:
+            if create:
+                os.ftruncate(fd, size)
+            self.buffer = mmap.mmap(fd, size)
+        except BaseException:
+            if create:
+                self.unlink()
+            raise
+        finally:
+            os.close(fd)
+        self.size = size
+
+    def array(self, offset, shape, dtype):
+        """NumPy view of part of the segment, writes go straight to shared memory"""
+        return np.ndarray(shape, dtype=dtype, buffer=self.buffer, offset=offset)
+
+    def close(self):
+        """Unmap, any arrays viewing the segment must be dropped first"""
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+
+    def unlink(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Layout:
+    """Named arrays packed one after another into a segment, each 64 byte aligned"""
+
+    def __init__(self, fields):
+        # fields is a list of (name, shape, dtype)
+        self.fields = list()
+        offset = 0
+        for name, shape, dtype in fields:
+            dtype = np.dtype(dtype)
+            self.fields.append((name, offset, shape, dtype))
+            offset += -(-int(np.prod(shape)) * dtype.itemsize // 64) * 64
+        self.size = max(offset, 1)
+
+    def arrays(self, segment):
+        return {name: segment.array(offset, shape, dtype) for name, offset, shape, dtype in self.fields}
@@ -0,0 +1,459 @@
+import copy
+import math
+import random
+
+from qgeometry import Geometry
+from qraster import rasterise
+
+NEVER = math.inf
+# Velocities are whole multiples of this. Sizes and start positions are whole or half
+# pixels, so every position is exact in floating point and n single frame moves land
+# exactly where one jump of n * velocity does. Off by at most 1/2048 px a frame from
+# the SGE games' speeds.
+VELOCITY_STEP = 2 ** -10
+
+
+def quantize(velocity):
+    return round(velocity / VELOCITY_STEP) * VELOCITY_STEP
+
+
+def _after(frames):
+    """The first frame past frames, or frames itself when it lands exactly on the bound.
+    Which side of an exact tie a position ends up on depends on rounding, so a tie frame
+    is left for step() to resolve"""
+    whole = math.floor(frames)
+    return whole if whole == frames else whole + 1
+
+
+def _before(frames):
+    """Moves that are safe when the position after frames moves is out of bounds. The
+    position before the first move was corrected last frame, so the first move is never
+    safe when it is out of bounds already"""
+    return max(frames, 1) - 1
+
+
+def first_below(value, rate, bound):
+    """First frame n >= 0 where value + n * rate < bound, or where it is exactly bound"""
+    if value < bound:
+        return 0
+    if rate >= 0:
+        return NEVER
+    return _after((value - bound) / -rate)
+
+
+def first_above(value, rate, bound):
+    """First frame n >= 0 where value + n * rate > bound, or where it is exactly bound"""
+    if value > bound:
+        return 0
+    if rate <= 0:
+        return NEVER
+    return _after((bound - value) / rate)
+
+
+def overlaps(box, other):
+    """Do two boxes with bbox_* attributes overlap, sim Boxes or SGE objects"""
+    return (box.bbox_left < other.bbox_right and box.bbox_right > other.bbox_left and
+            box.bbox_top < other.bbox_bottom and box.bbox_bottom > other.bbox_top)
+
+
+def crossed(box, other, dx, dy, other_dy):
+    """Did the move just made by (dx, dy) take box's leading edge across other's near face?
+
+    Catches a fast ball that jumped clean over a thin paddle within one frame, which
+    an overlap test misses, by checking the vertical overlap at the moment the edge
+    crossed the face. other moved other_dy at the same time.
+    """
+    if dx < 0:
+        start_edge = box.bbox_left - dx
+        if not start_edge >= other.bbox_right > box.bbox_left:
+            return False
+        t = (start_edge - other.bbox_right) / -dx
+    elif dx > 0:
+        start_edge = box.bbox_right - dx
+        if not start_edge <= other.bbox_left < box.bbox_right:
+            return False
+        t = (other.bbox_left - start_edge) / dx
+    else:
+        return False
+    top = box.bbox_top - dy * (1 - t)
+    other_top = other.bbox_top - other_dy * (1 - t)
+    return top < other_top + other.bbox_height and top + box.bbox_height > other_top
+
+
+class Box:
+    """Just enough of sge.dsp.Object for the game rules, position, velocity and bbox"""
+
+    def __init__(self, x, y, width, height, origin_x, origin_y):
+        self.x = x
+        self.y = y
+        self.xstart = x
+        self.ystart = y
+        self.xvelocity = 0
+        self.yvelocity = 0
+        self.bbox_width = width
+        self.bbox_height = height
+        self.origin_x = origin_x
+        self.origin_y = origin_y
+
+    @property
+    def bbox_left(self):
+        return self.x - self.origin_x
+
+    @bbox_left.setter
+    def bbox_left(self, value):
+        self.x = value + self.origin_x
+
+    @property
+    def bbox_right(self):
+        return self.x - self.origin_x + self.bbox_width
+
+    @bbox_right.setter
+    def bbox_right(self, value):
+        self.x = value + self.origin_x - self.bbox_width
+
+    @property
+    def bbox_top(self):
+        return self.y - self.origin_y
+
+    @bbox_top.setter
+    def bbox_top(self, value):
+        self.y = value + self.origin_y
+
+    @property
+    def bbox_bottom(self):
+        return self.y - self.origin_y + self.bbox_height
+
+    @bbox_bottom.setter
+    def bbox_bottom(self, value):
+        self.y = value + self.origin_y - self.bbox_height
+
+    def move(self):
+        self.x += self.xvelocity
+        self.y += self.yvelocity
+
+    def collides(self, other):
+        return overlaps(self, other)
+
+    def box(self):
+        return self.bbox_left, self.bbox_top, self.bbox_width, self.bbox_height
+
+
+class SimPlayer(Box):
+    def __init__(self, sim, playerNum, paddle_x_offset=8, paddle_speed=4, paddle_vertical_force=1 / 12):
+        self.playerNum = playerNum
+        self.paddle_speed = quantize(sim.geometry.speed_y(paddle_speed))
+        self.paddle_vertical_force = paddle_vertical_force
+        self.score = 0
+        if playerNum == 1:
+            x = sim.geometry.x(paddle_x_offset)
+            self.hit_direction = 1
+        else:
+            x = sim.width - sim.geometry.x(paddle_x_offset)
+            self.hit_direction = -1
+        super().__init__(x, sim.height / 2, *sim.paddle_geometry)
+
+    def perform_action(self, action):
+        self.yvelocity = action * self.paddle_speed
+
+    def collide_with_ball(self, sim):
+        sim.bounce_count += 1
+        self.score += 5
+
+    def step(self, height):
+        # Keep the paddle inside the window
+        if self.bbox_top < 0:
+            self.bbox_top = 0
+        elif self.bbox_bottom > height:
+            self.bbox_bottom = height
+
+    def pinned(self, height):
+        """Pushing into a wall, moving then clamping puts the paddle back where it was"""
+        y = self.y
+        self.move()
+        self.step(height)
+        pinned = self.y == y
+        self.y = y
+        return pinned
+
+    def moved(self, height):
+        """A copy of the paddle where this frame's move leaves it. An SGE ScriptedPlayer
+        decides after SGE has moved its paddle, give controllers this to see the same"""
+        paddle = copy.copy(self)
+        paddle.move()
+        paddle.step(height)
+        return paddle
+
+    def clamp_frames(self, height):
+        """Frames that move the paddle without a clamp"""
+        if self.pinned(height):
+            return NEVER
+        return _before(min(first_below(self.bbox_top, self.yvelocity, 0),
+                           first_above(self.bbox_bottom, self.yvelocity, height)))
+
+
+class SimBall(Box):
+    def __init__(self, sim, start_speed=2, acceleration=0.2, max_speed=15):
+        self.start_speed = quantize(sim.geometry.speed_x(start_speed))
+        self.acceleration = quantize(sim.geometry.speed_x(acceleration))
+        self.max_speed = quantize(sim.geometry.speed_x(max_speed))
+        super().__init__(sim.width / 2, sim.height / 2, *sim.ball_geometry)
+
+    def step(self, width, height):
+        # Bouncing off of the edges
+        if self.bbox_bottom > height:
+            self.bbox_bottom = height
+            self.yvelocity = -abs(self.yvelocity)
+        elif self.bbox_top < 0:
+            self.bbox_top = 0
+            self.yvelocity = abs(self.yvelocity)
+
+    def collide(self, other):
+        if other.hit_direction == 1:
+            self.bbox_left = other.bbox_right + 1
+        else:
+            self.bbox_right = other.bbox_left - 1
+
+        self.xvelocity = min(abs(self.xvelocity) + self.acceleration,
+                             self.max_speed) * other.hit_direction
+        self.yvelocity += quantize((self.y - other.y) * other.paddle_vertical_force)
+
+    def wall_frames(self, width, height):
+        """Frames that move the ball without a bounce"""
+        return _before(min(first_above(self.bbox_bottom, self.yvelocity, height),
+                           first_below(self.bbox_top, self.yvelocity, 0)))
+
+
+class SimSquashBall(SimBall):
+    def step(self, width, height):
+        # Bouncing off of the edges
+        if self.bbox_bottom > height:
+            self.bbox_bottom = height
+            self.yvelocity = -abs(self.yvelocity)
+        elif self.bbox_top < 0:
+            self.bbox_top = 0
+            self.yvelocity = abs(self.yvelocity)
+        elif self.bbox_right > width:
+            self.bbox_right = width
+            self.xvelocity = -abs(self.xvelocity)
+
+    def wall_frames(self, width, height):
+        return min(super().wall_frames(width, height),
+                   _before(first_above(self.bbox_right, self.xvelocity, width)))
+
+
+class PongSim:
+    """Headless Pong with the same rules, geometry and frame order as qpong.Pong.
+
+A frame checks for goals, then moves the paddles and the ball, applies the actions
+(which move the paddles from the next frame on), clamps the paddles, bounces the
+ball off the walls and finally resolves paddle hits, in the order SGE runs them.
+Actions are decided before the frame, where an SGE ScriptedPlayer decides during
+it and sees the ball moved or not depending on SGE's object order.
+
+    No SGE or pygame, step() advances one frame with one PlayerActions value per
+    player and returns the goal scored this frame (1 player 1, -1 player 2, 0 none).
+    observe() rasterises the frame like the screen would look.
+    """
+
+    points_to_win = 4
+    ball_class = SimBall
+
+    def __init__(self, width=80, height=60, seed=None, num_players=2):
+        self.width = width
+        self.height = height
+        self.geometry = Geometry(width, height)
+        self.x_scalar = self.geometry.x_scalar
+        self.y_scalar = self.geometry.y_scalar
+        self.num_players = num_players
+        self.paddle_geometry = self.geometry.paddle
+        self.ball_geometry = self.geometry.ball
+        self.reset(seed)
+
+    def reset(self, seed=None):
+        self.rng = random.Random(seed)
+        self.frame_count = 0
+        self.bounce_count = 0
+        self.game_over_flag = False
+        self.players = [SimPlayer(self, n + 1) for n in range(self.num_players)]
+        self.ball = self.ball_class(self)
+        self.serve()
+
+    @property
+    def player1(self):
+        return self.players[0]
+
+    @property
+    def player2(self):
+        return self.players[1] if self.num_players > 1 else 0
+
+    def serve(self, direction=None):
+        if direction is None:
+            direction = self.rng.choice([-1, 1])
+
+        ball = self.ball
+        ball.x = ball.xstart
+        ball.y = ball.ystart
+        self.bounce_count = 0
+        ball.xvelocity = ball.start_speed * direction
+        ball.yvelocity = 0
+
+    def check_game_over(self):
+        return any(player.score >= self.points_to_win for player in self.players)
+
+    def game_over_pending(self):
+        """check_game_over without side effects"""
+        return self.check_game_over()
+
+    def check_goalline(self):
+        if self.ball.bbox_right < 0:
+            return -1
+        elif self.ball.bbox_left > self.width:
+            return 1
+        else:
+            return 0
+
+    def check_scored_goal(self):
+        if self.check_game_over():
+            self.ball.xvelocity = 0
+            self.ball.yvelocity = 0
+            self.game_over_flag = True
+            return 0
+        score = self.check_goalline()
+        if score != 0:
+            self.scored(score)
+            self.serve(score)
+        return score
+
+    def scored(self, score):
+        self.player1.score += score == 1
+        if self.num_players > 1: self.player2.score += score == -1
+
+    def step(self, *actions):
+        self.frame_count += 1
+        score = self.check_scored_goal()
+        if self.game_over_flag:
+            return score
+
+        # SGE moves every object first and then runs its event_step, so an action
+        # only moves the paddle from the next frame on and the clamp and bounce
+        # correct this frame's move
+        ball = self.ball
+        ball_x, ball_y = ball.x, ball.y
+        player_ys = [player.y for player in self.players]
+        for player, action in zip(self.players, actions):
+            player.move()
+            player.perform_action(action)
+            player.step(self.height)
+        ball.move()
+        ball.step(self.width, self.height)
+
+        # SGE's overlap collisions, then the swept test qgame.Ball.event_end_step adds
+        for player in self.players:
+            if ball.collides(player):
+                self.hit(player)
+        for player, player_y in zip(self.players, player_ys):
+            if not ball.collides(player) and \
+                    crossed(ball, player, ball.x - ball_x, ball.y - ball_y, player.y - player_y):
+                self.hit(player)
+        return score
+
+    def hit(self, player):
+        self.ball.collide(player)
+        player.collide_with_ball(self)
+
+    def collision_frames(self, player):
+        """Frames that move the ball without reaching player's paddle, ignoring height"""
+        ball = self.ball
+        vx = ball.xvelocity
+        if vx < 0:
+            if ball.bbox_right <= player.bbox_left:
+                return NEVER
+            return first_below(ball.bbox_left + vx, vx, player.bbox_right)
+        elif vx > 0:
+            if ball.bbox_left >= player.bbox_right:
+                return NEVER
+            return first_above(ball.bbox_right + vx, vx, player.bbox_left)
+        elif ball.bbox_left < player.bbox_right and ball.bbox_right > player.bbox_left:
+            return 0
+        return NEVER
+
+    def safe_frames(self):
+        """How many frames at the current velocities are nothing but straight line motion.
+
+        That is no goal, wall bounce, paddle clamp or paddle contact, so they can be
+        jumped over in closed form. The goal check looks at where the last frame left
+        the ball, so a ball past the goal line scores a frame later.
+        """
+        if self.game_over_flag or self.game_over_pending():
+            return 0
+        ball = self.ball
+        frames = min(ball.wall_frames(self.width, self.height),
+                     first_below(ball.bbox_right, ball.xvelocity, 0),
+                     first_above(ball.bbox_left, ball.xvelocity, self.width))
+        for player in self.players:
+            frames = min(frames, player.clamp_frames(self.height), self.collision_frames(player))
+        return frames
+
+    def jump(self, frames):
+        """Advance frames frames that safe_frames says are straight line motion"""
+        for player in self.players:
+            if not player.pinned(self.height):
+                player.y += frames * player.yvelocity
+        ball = self.ball
+        ball.x += frames * ball.xvelocity
+        ball.y += frames * ball.yvelocity
+        self.frame_count += frames
+
+    def fast_forward(self, actions, max_frames):
+        """Jump straight to the next event with actions held, step it and return
+        (frames advanced, goal scored), never advancing more than max_frames.
+
+        An event is anything safe_frames looks out for. Actions only move the paddles
+        from the frame after they are taken, so a changed action is stepped on its
+        own first. Otherwise the straight line stretch is jumped in one multiply and
+        the event frame is stepped normally. Positions are exact (see VELOCITY_STEP),
+        so goals, bounces and hits land on the same frames as calling step() and
+        positions are identical. Returning after every event lets scripted
+        controllers and agents re-decide.
+        """
+        for player, action in zip(self.players, actions):
+            if player.yvelocity != action * player.paddle_speed:
+                return 1, self.step(*actions)
+        skip = min(self.safe_frames(), max_frames - 1)
+        if skip > 0:
+            self.jump(skip)
+        else:
+            skip = 0
+        return skip + 1, self.step(*actions)
+
+    def net(self):
+        return self.geometry.net()
+
+    def observe(self):
+        boxes = [player.box() for player in self.players] + [self.ball.box()]
+        return rasterise(self.width, self.height, boxes, self.net()).reshape((1, -1))
+
+
+class SquashSim(PongSim):
+    """Headless qsquash.Squash, one player against the right hand wall"""
+
+    ball_class = SimSquashBall
+
+    def __init__(self, width=80, height=60, seed=None):
+        super().__init__(width, height, seed, num_players=1)
+
+    def reset(self, seed=None):
+        self.goals = 0
+        super().reset(seed)
+
+    def check_game_over(self):
+        if self.check_goalline() != 0:
+            self.goals += 1
+        return self.goals > self.points_to_win
+
+    def game_over_pending(self):
+        return self.goals > self.points_to_win
+
+    def scored(self, score):
+        # single player game, the player can only concede
+        self.player1.score -= 1
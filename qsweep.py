@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""Parallel hyperparameter sweeps over any train(config, callback) function.
+
+Trials run in a pool of long lived worker processes, each pinned to its own CPU,
+which import the training module once and reuse it for every trial they get.
+Every trial gets its own seed, and a trial whose running mean score falls below
+the median of the other trials at the same epoch is stopped early.
+
+    python3 qsweep.py PlayCatch:train
+"""
+import csv
+import importlib
+import itertools
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+from qmodels import get_architecture
+from qtrain import TrainConfig
+
+_worker = dict()
+
+
+def grid(space):
+    """Every combination of space = {setting: [values]}"""
+    names = sorted(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+
+def random_search(space, trials, seed=None):
+    """trials samples of space = {setting: [values] or (low, high) or (low, high, "log")}"""
+    rng = random.Random(seed)
+    samples = list()
+    for _ in range(trials):
+        params = dict()
+        for name, values in sorted(space.items()):
+            if isinstance(values, list):
+                params[name] = rng.choice(values)
+            elif len(values) == 3 and values[2] == "log":
+                params[name] = float(np.exp(rng.uniform(np.log(values[0]), np.log(values[1]))))
+            elif isinstance(values[0], int) and isinstance(values[1], int):
+                params[name] = rng.randint(values[0], values[1])
+            else:
+                params[name] = rng.uniform(values[0], values[1])
+        samples.append(params)
+    return samples
+
+
+def make_config(base_config, params, seed):
+    """TrainConfig for a trial, lr and hidden_size are folded into the architecture"""
+    settings = {k: v for k, v in params.items() if k not in ("lr", "hidden_size")}
+    architecture = None
+    if "hidden_size" in params or "lr" in params:
+        # a copy of the base architecture, named or not, so everything else about it is kept
+        architecture = dict(get_architecture(base_config.architecture))
+    if "hidden_size" in params:
+        architecture["hidden"] = [params["hidden_size"], params["hidden_size"]]
+    if "lr" in params:
+        architecture["lr"] = params["lr"]
+    if architecture is not None:
+        settings["architecture"] = architecture
+    # trials never share files with each other or the main run
+    return base_config.replace(seed=seed, weights_file=None, checkpoint_dir=None, publish_file=None,
+                               view_name=None, verbose=False, **settings)
+
+
+class MedianStopper:
+    """Median stopping rule over the running mean scores every trial has reported"""
+
+    def __init__(self, shared, trial, grace_epochs=10, min_trials=3):
+        self.shared = shared
+        self.trial = trial
+        self.grace_epochs = grace_epochs
+        self.min_trials = min_trials
+
+    def __call__(self, stats):
+        epoch = stats["epoch"]
+        self.shared[(self.trial, epoch)] = stats["mean_score"]
+        if epoch < self.grace_epochs:
+            return False
+        others = [v for (trial, e), v in self.shared.items() if e == epoch and trial != self.trial]
+        return len(others) >= self.min_trials and stats["mean_score"] < np.median(others)
+
+
+def _init_worker(target, next_cpu, shared):
+    with next_cpu.get_lock():
+        cpu = next_cpu.value
+        next_cpu.value += 1
+    if hasattr(os, "sched_setaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, {cpus[cpu % len(cpus)]})
+
+    module_name, function_name = target.split(":")
+    _worker["train"] = getattr(importlib.import_module(module_name), function_name)
+    _worker["shared"] = shared
+
+
+def _run_trial(job):
+    trial, params, config = job
+    stopper = MedianStopper(_worker["shared"], trial, **config.pop("stopper"))
+    config = TrainConfig(**config)
+    start = time.perf_counter()
+    history = _worker["train"](config, callback=stopper)
+    last = history[-1] if history else {"mean_score": 0, "epoch": -1}
+    return {"trial": trial,
+            "seed": config.seed,
+            "mean_score": last["mean_score"],
+            "epochs": last["epoch"] + 1,
+            "stopped": last["epoch"] + 1 < config.epoch,
+            "seconds": time.perf_counter() - start,
+            "params": params}
+
+
+def sweep(target, trials, base_config=None, processes=None, seed=0, grace_epochs=10, min_trials=3,
+          results_file="sweep_results.csv"):
+    """Run every params dict in trials through target ("module:function") and write a results table"""
+    base_config = base_config or TrainConfig()
+    # workers are spawned rather than forked, a forked one already has NumPy and its
+    # BLAS threads from this process. Spawned ones import NumPy after OMP_NUM_THREADS
+    # is set, so they run one BLAS thread each and the parallelism comes from the pool.
+    context = multiprocessing.get_context("spawn")
+    manager = context.Manager()
+    shared = manager.dict()
+    next_cpu = context.Value("i", 0)
+
+    jobs = list()
+    for trial, params in enumerate(trials):
+        config = make_config(base_config, params, seed + trial).as_dict()
+        config["stopper"] = {"grace_epochs": grace_epochs, "min_trials": min_trials}
+        jobs.append((trial, params, config))
+
+    threads = os.environ.get("OMP_NUM_THREADS")
+    os.environ["OMP_NUM_THREADS"] = threads or "1"
+    try:
+        pool = context.Pool(processes, initializer=_init_worker, initargs=(target, next_cpu, shared))
+    finally:
+        if threads is None:
+            del os.environ["OMP_NUM_THREADS"]
+    with pool:
+        results = list()
+        for result in pool.imap_unordered(_run_trial, jobs):
+            results.append(result)
+            print("Trial {trial:03d} | Mean Score {mean_score:.3f} | Epochs {epochs} | {params}".format(**result))
+
+    results.sort(key=lambda r: r["mean_score"], reverse=True)
+    write_results(results, results_file)
+    return results
+
+
+def write_results(results, filename):
+    names = sorted(set(name for result in results for name in result["params"]))
+    with open(filename, "w", newline="") as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(["trial", "seed", "mean_score", "epochs", "stopped", "seconds"] + names)
+        for r in results:
+            writer.writerow([r["trial"], r["seed"], "{:.4f}".format(r["mean_score"]), r["epochs"], r["stopped"],
+                             "{:.1f}".format(r["seconds"])] + [r["params"].get(name, "") for name in names])
+
+
+if __name__ == '__main__':
+    target = sys.argv[1] if len(sys.argv) > 1 else "PlayCatch:train"
+    space = {"epsilon": [.05, .1, .2],
+             "max_memory": [100, 500],
+             "batch_size": [20, 50],
+             "hidden_size": [50, 100],
+             "lr": [.05, .2]}
+    base_config = TrainConfig(epoch=200, width=10, height=10) if target.startswith("PlayCatch") else TrainConfig()
+    sweep(target, grid(space), base_config)
@@ -0,0 +1,376 @@
+import json
+from collections import deque
+from os import path
+
+import numpy as np
+
+from qcheckpoint import Checkpointer
+from qexplore import EpsilonSchedule
+from qmemory import MemoryTracker
+from qmodels import build_model
+from qpolicy import save_weights
+
+
+class TrainConfig:
+    """Training settings that used to live in each script's module globals.
+
+    TrainConfig(epsilon=.1, batch_size=50) overrides the defaults, unknown
+    settings raise a TypeError so typos don't silently train with a default.
+    """
+
+    defaults = {
+        "epsilon": .2,  # exploration, see qexplore for the schedules
+        "epsilon_final": None,  # anneal epsilon linearly to this
+        "epsilon_steps": 0,  # over this many agent steps
+        "epsilon_alpha": None,  # Ape-X, actor i of N explores with epsilon ** (1 + alpha * i / (N - 1))
+        "num_actions": 3,  # [move_left, stay, move_right]
+        "epoch": 100,
+        "max_memory": 100,
+        "batch_size": 20,
+        "discount": .9,
+        "n_step": 1,  # rewards summed over n steps before bootstrapping
+        "double_dqn": False,  # online network picks the next action, target network values it
+        "target_update": 0,  # steps between target network syncs, 0 bootstraps from the online network
+        "architecture": "mlp100",  # see qmodels.ARCHITECTURES
+        "backend": "keras",  # or numpy, qmlp.NumpyMLP trains mlp networks without Keras
+        "width": 80,
+        "height": 60,
+        "seed": None,  # set to make runs repeatable
+        "weights_file": None,  # loaded on start if present, saved at the end
+        "resume_weights": True,  # False trains from scratch and only saves weights_file
+        "checkpoint_dir": None,  # checkpoint in the background and resume from here
+        "checkpoint_every": 5,
+        "publish_file": None,  # .npz weights published every epoch, e.g. for qserve to hot reload
+        "view_name": None,  # shared memory name a qview viewer can attach to and watch training
+        "memory_profile": False,  # sample tracemalloc and RSS every epoch, see qmemory
+        "memory_budget": None,  # kB of growth per epoch, more raises qmemory.MemoryGrowthError after training
+        "memory_warmup": 5,  # epochs left out of the growth
+        "verbose": True,
+    }
+
+    def __init__(self, **kwargs):
+        for key in kwargs:
+            if key not in self.defaults:
+                raise TypeError("Unknown training setting {}".format(key))
+        for key, value in self.defaults.items():
+            setattr(self, key, kwargs.get(key, value))
+        if self.double_dqn and not self.target_update > 0:
+            # without a target network the online network both picks and values, a plain max
+            raise ValueError("double_dqn needs a target network, set target_update > 0")
+
+    def replace(self, **kwargs):
+        settings = self.as_dict()
+        settings.update(kwargs)
+        return TrainConfig(**settings)
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.defaults}
+
+
+def q_targets(model, inputs, actions, rewards, next_inputs, not_over, discounts, target_model=None, double=False):
+    """Q-learning targets for a batch of transitions.
+
+    discounts is what the bootstrapped value is scaled by, discount ** n for n-step
+    returns. The online network sees the current and next states in one forward
+    pass. With a target_model it values the next states, and with double the online
+    network picks the action it values rather than taking the target network's max.
+    """
+    count = len(inputs)
+    q = model.predict(np.vstack([inputs, next_inputs]))
+    targets = q[:count].astype(np.float32).reshape((count, -1))
+    next_q = q[count:] if target_model is None else target_model.predict(next_inputs)
+    if double:
+        Q_sa = next_q[np.arange(count), np.argmax(q[count:], axis=1)]
+    else:
+        Q_sa = np.max(next_q, axis=1)
+
+    # There should be no target values for actions not taken.
+    # Thou shalt not correct actions not taken #deep
+    # return_t + gamma^n * max_a' Q(s', a'), or just return_t when the game is over
+    targets[np.arange(count), actions] = rewards + discounts * Q_sa * not_over
+    return targets
+
+
+class NStepReturns:
+    """Turns one step transitions into n-step ones incrementally as they arrive.
+
+    add() returns the transitions that just completed as (state_t, action, discounted
+    return, state_t+n, game_over, discount ** n). When the game ends first the
+    pending transitions complete early with game_over set, so the return is never
+    summed across games or bootstrapped from a finished one. An episode that is
+    truncated, cut off by a time limit rather than finished, completes them early
+    too but without game_over, they bootstrap from the last state.
+    """
+
+    def __init__(self, n=1, discount=.9):
+        self.n = n
+        self.powers = [discount ** k for k in range(n + 1)]
+        self.pending = deque()  # [state_t, action, return so far, steps so far]
+
+    def add(self, state_t, action, reward, state_tp1, game_over, truncated=False):
+        self.pending.append([state_t, action, 0., 0])
+        for transition in self.pending:
+            transition[2] += self.powers[transition[3]] * reward
+            transition[3] += 1
+        done = list()
+        terminal = game_over and not truncated
+        while self.pending and (game_over or truncated or self.pending[0][3] == self.n):
+            state, action, ret, steps = self.pending.popleft()
+            done.append((state, action, ret, state_tp1, terminal, self.powers[steps]))
+        return done
+
+
+class ExperienceReplay(object):
+    def __init__(self, max_memory=100, discount=.9, rng=np.random, n_step=1):
+        self.max_memory = max_memory
+        self.memory = list()
+        self.discount = discount
+        self.rng = rng
+        self.n_step = NStepReturns(n_step, discount)
+
+    def remember(self, state_t, action, reward, state_tp1, game_over, truncated=False):
+        # states are referenced not copied, consecutive transitions share frames
+        for transition in self.n_step.add(state_t, action, reward, state_tp1, game_over, truncated):
+            self.memory.append(transition)
+        if len(self.memory) > self.max_memory:
+            del self.memory[:len(self.memory) - self.max_memory]
+
+    def get_batch(self, model, batch_size=10, target_model=None, double=False):
+        len_memory = len(self.memory)
+        if len_memory == 0:
+            return None, None
+        samples = [self.memory[idx] for idx in self.rng.randint(0, len_memory, size=min(len_memory, batch_size))]
+
+        inputs = np.vstack([s[0] for s in samples]).astype(np.float32)
+        next_inputs = np.vstack([s[3] for s in samples]).astype(np.float32)
+        actions = np.array([s[1] for s in samples])
+        rewards = np.array([s[2] for s in samples], dtype=np.float32)
+        not_over = np.array([not s[4] for s in samples], dtype=np.float32)
+        discounts = np.array([s[5] for s in samples], dtype=np.float32)
+        return inputs, q_targets(model, inputs, actions, rewards, next_inputs, not_over, discounts,
+                                 target_model, double)
+
+
+class DQNAgent:
+    """A Q-network, its experience replay and epsilon greedy exploration.
+
+    Several agents can share one model (e.g. both players in a Pong game) by
+    passing the same model in, each keeps its own replay and random stream.
+    actor and num_actors pick the agent's epsilon schedule, see qexplore.
+    """
+
+    def __init__(self, config, model=None, seed=None, actor=0, num_actors=1):
+        self.config = config
+        if model is None:
+            if config.seed is not None:
+                np.random.seed(config.seed)  # weight initialisation
+            model = build_model(config.architecture, config.width, config.height, config.num_actions,
+                                config.backend)
+        self.model = model
+        self.rng = np.random.RandomState(config.seed if seed is None else seed)
+        self.exp_replay = ExperienceReplay(max_memory=config.max_memory, discount=config.discount, rng=self.rng,
+                                           n_step=config.n_step)
+        self.schedule = EpsilonSchedule.for_config(config, actor, num_actors)
+        self.epsilon = self.schedule(0)
+        self.loss = 0.
+        self.explored = 0  # actions taken at random, and with the network, since the counts were reset
+        self.inferred = 0
+        self.steps = 0
+        self.target_model = None
+        if config.target_update:
+            self.target_model = build_model(config.architecture, config.width, config.height, config.num_actions,
+                                            config.backend)
+
+    def explore(self):
+        """A random action if this step explores, otherwise None and the network has to decide"""
+        # explore the action space with an epsilon random move every now and again
+        self.epsilon = self.schedule(self.steps)
+        if self.rng.rand() <= self.epsilon:
+            self.explored += 1
+            return self.rng.randint(0, self.config.num_actions)
+        self.inferred += 1
+        return None
+
+    def act(self, state):
+        """Action index for state, 0..num_actions-1"""
+        action = self.explore()
+        if action is not None:
+            return action
+        q = self.model.predict(state)
+        return int(np.argmax(q[0]))
+
+    def update_target(self):
+        if self.target_model is not None:
+            self.target_model.set_weights(self.model.get_weights())
+
+    def observe(self, state_t, action, reward, state_tp1, game_over, truncated=False):
+        """Store a transition and adapt the model, truncated when a time limit ended the
+        episode, the game isn't over and the target bootstraps from state_tp1"""
+        if self.target_model is not None and self.steps % self.config.target_update == 0:
+            self.update_target()
+        self.steps += 1
+        self.exp_replay.remember(state_t, action, reward, state_tp1, game_over, truncated)
+        inputs, targets = self.exp_replay.get_batch(self.model, batch_size=self.config.batch_size,
+                                                    target_model=self.target_model, double=self.config.double_dqn)
+        if inputs is not None:
+            self.loss += self.model.train_on_batch(inputs, targets)
+
+    def get_state(self):
+        return {"epsilon": self.epsilon,
+                "replay": list(self.exp_replay.memory),
+                # add() updates pending transitions in place while the checkpoint thread pickles them
+                "pending": [list(transition) for transition in self.exp_replay.n_step.pending],
+                "steps": self.steps,
+                "rng": self.rng.get_state()}
+
+    def set_state(self, state):
+        self.epsilon = state["epsilon"]
+        self.exp_replay.memory = list(state["replay"])
+        self.exp_replay.n_step.pending = deque(state.get("pending", ()))
+        self.steps = state.get("steps", 0)
+        self.rng.set_state(state["rng"])
+        # the model has just been restored, the target network follows it
+        self.update_target()
+
+
+def act_batch(agents, states):
+    """One action per agent for its (1, n) state, the agents share a model.
+
+    Every agent decides whether it explores first and only the states of the
+    agents that don't go through the network, in one batch.
+    """
+    actions = [agent.explore() for agent in agents]
+    greedy = [n for n, action in enumerate(actions) if action is None]
+    if greedy:
+        q = agents[greedy[0]].model.predict(np.vstack([states[n] for n in greedy]))
+        for n, best in zip(greedy, np.argmax(q, axis=1)):
+            actions[n] = int(best)
+    return actions
+
+
+class Trainer:
+    """Runs the epoch loop shared by every game.
+
+    run_episode(epoch, seed) plays one episode with the agents and returns a dict
+    of stats, "score" is accumulated into the mean score. Loads config.weights_file
+    on start unless config.resume_weights is off, checkpoints into config.checkpoint_dir and resumes from it.
+    callback(stats) is called after every epoch, returning True stops training early.
+    """
+
+    def __init__(self, config, agents, run_episode, callback=None):
+        self.config = config
+        self.agents = agents
+        self.model = agents[0].model
+        self.run_episode = run_episode
+        self.callback = callback
+        self.total_score = 0
+        self.history = list()
+        self.checkpointer = None
+        if config.checkpoint_dir is not None:
+            self.checkpointer = Checkpointer(config.checkpoint_dir)
+        self.memory_tracker = None
+        if config.memory_profile:
+            self.memory_tracker = MemoryTracker(warmup=config.memory_warmup)
+
+    def episode_seed(self, epoch):
+        return None if self.config.seed is None else self.config.seed + epoch
+
+    def training_state(self):
+        return {"agents": [agent.get_state() for agent in self.agents],
+                "total_score": self.total_score,
+                "history": list(self.history),
+                "np_rng": np.random.get_state()}
+
+    def resume(self):
+        if self.config.resume_weights and self.config.weights_file is not None and \
+                path.isfile(self.config.weights_file):
+            self.model.load_weights(self.config.weights_file)
+
+        if self.checkpointer is None:
+            return 0
+        checkpoint = self.checkpointer.load_latest()
+        if checkpoint is None:
+            return 0
+        checkpoint.restore_model(self.model)
+        for agent, state in zip(self.agents, checkpoint.state["agents"]):
+            agent.set_state(state)
+        self.total_score = checkpoint.state["total_score"]
+        self.history = list(checkpoint.state["history"])
+        np.random.set_state(checkpoint.state["np_rng"])
+        self.log_message("Resuming from epoch {:03d}".format(checkpoint.epoch + 1))
+        return checkpoint.epoch + 1
+
+    def log_message(self, message):
+        if self.config.verbose:
+            print(message)
+
+    def log(self, stats):
+        message = "Epoch {:03d}/{:03d} | Loss {:.4f} | Score {} | Mean Score {:.2f}".format(
+            stats["epoch"], self.config.epoch - 1, stats["loss"], stats.get("score", 0), stats["mean_score"])
+        message += " | Epsilon {:.3f} ({} explored, {} inferred)".format(
+            stats["epsilon"], stats["explored"], stats["inferred"])
+        if "traced_kb" in stats:
+            message += " | RSS {} kB | Traced {:.0f} kB".format(stats["rss_kb"], stats["traced_kb"])
+        self.log_message(message)
+
+    def run(self):
+        start_epoch = self.resume()
+        schedules = list()
+        for agent in self.agents:
+            if str(agent.schedule) not in schedules:
+                schedules.append(str(agent.schedule))
+        self.log_message("Exploration | {}".format(", ".join(schedules)))
+        last_epoch = start_epoch - 1
+        for e in range(start_epoch, self.config.epoch):
+            for agent in self.agents:
+                agent.loss = 0.
+                agent.explored = 0
+                agent.inferred = 0
+            stats = self.run_episode(e, self.episode_seed(e))
+            self.total_score += stats.get("score", 0)
+            stats["epoch"] = e
+            stats["loss"] = sum(agent.loss for agent in self.agents)
+            stats["epsilon"] = float(np.mean([agent.epsilon for agent in self.agents]))
+            stats["explored"] = sum(agent.explored for agent in self.agents)
+            stats["inferred"] = sum(agent.inferred for agent in self.agents)
+            stats["mean_score"] = self.total_score / (len(self.history) + 1)
+            if self.memory_tracker is not None:
+                stats.update(self.memory_tracker.sample(e))
+            self.history.append(stats)
+            self.log(stats)
+            last_epoch = e
+
+            if self.config.publish_file is not None:
+                save_weights(self.config.publish_file, self.model.get_weights())
+
+            if self.checkpointer is not None and (e + 1) % self.config.checkpoint_every == 0:
+                self.checkpointer.save(e, self.model, self.training_state())
+
+            if self.callback is not None and self.callback(stats):
+                self.log_message("Stopping early at epoch {:03d}".format(e))
+                break
+
+        if self.checkpointer is not None:
+            # checkpoint the last epoch too, or resume() would load an older checkpoint over
+            # the weights_file saved below and train those epochs again
+            if last_epoch >= start_epoch and (last_epoch + 1) % self.config.checkpoint_every != 0:
+                self.checkpointer.save(last_epoch, self.model, self.training_state())
+            self.checkpointer.close()
+        self.save()
+        if self.memory_tracker is not None:
+            self.check_memory()
+        return self.history
+
+    def check_memory(self):
+        self.log_message(self.memory_tracker.report())
+        self.memory_tracker.stop()
+        if self.config.memory_budget is not None:
+            self.memory_tracker.check(self.config.memory_budget)
+
+    def save(self):
+        # Save trained model weights and architecture, this will be used by the visualization code
+        if self.config.weights_file is None:
+            return
+        self.model.save_weights(self.config.weights_file, overwrite=True)
+        with open(path.splitext(self.config.weights_file)[0] + ".json", "w") as outfile:
+            json.dump(self.model.to_json(), outfile)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""Watch a training run from another process.
+
+The trainer publishes what its agent sees into a small ring of frames in shared
+memory with a FrameBroadcaster, a viewer attaches to it by name, draws the newest
+frame at its own rate and can come and go without the trainer noticing. While
+nobody is watching publishing is a counter check, frames are only copied once a
+viewer has signalled it is attached.
+
+    python3 qpong_ai.py --view qpong_view
+    python3 qview.py qpong_view
+"""
+import argparse
+import time
+
+import numpy as np
+
+from qshm import Layout, SharedSegment
+
+HEADER_FIELDS = 5  # width, height, slots, frames written, trainer closed
+VIEWER_TIMEOUT = 2.  # seconds without a viewer heartbeat before publishing stops
+
+
+def ring_layout(width, height, slots):
+    return Layout([("header", (HEADER_FIELDS,), np.int64),
+                   ("heartbeat", (1,), np.float64),
+                   ("versions", (slots,), np.int64),
+                   ("frames", (slots, width * height), np.uint8),
+                   ("scores", (slots, 2), np.int32),
+                   ("frame_numbers", (slots,), np.int64)])
+
+
+class _Ring:
+    fields = ("header", "heartbeat", "versions", "frames", "scores", "frame_numbers")
+
+    def _map(self, segment, width, height, slots):
+        self.segment = segment
+        self.width = width
+        self.height = height
+        self.slots = slots
+        for name, array in ring_layout(width, height, slots).arrays(segment).items():
+            setattr(self, name, array)
+
+    def _unmap(self):
+        for name in self.fields:
+            setattr(self, name, None)
+        self.segment.close()
+
+
+class FrameBroadcaster(_Ring):
+    """Trainer side, publish() every frame, it returns straight away unless a viewer is attached"""
+
+    def __init__(self, name, width, height, slots=4, check_every=60, replace=False):
+        layout = ring_layout(width, height, slots)
+        self._map(SharedSegment(name, layout.size, create=True, replace=replace), width, height, slots)
+        self.header[:] = (width, height, slots, 0, 0)
+        self.check_every = check_every
+        self.countdown = 0
+        self.attached = False
+        self.written = 0
+
+    @classmethod
+    def for_config(cls, config):
+        """A broadcaster for config.view_name, or None when the run isn't being shared.
+
+        A ring left behind under that name by a trainer that crashed is replaced, so
+        only one trainer at a time can use a view name.
+        """
+        if config.view_name is None:
+            return None
+        return cls(config.view_name, config.width, config.height, replace=True)
+
+    def viewer_attached(self):
+        # the clock is only read every check_every frames
+        self.countdown -= 1
+        if self.countdown <= 0:
+            self.countdown = self.check_every
+            self.attached = time.time() - self.heartbeat[0] < VIEWER_TIMEOUT
+        return self.attached
+
+    def publish(self, observation, scores, frame_number):
+        """observation is a flattened width x height frame with values 0-1"""
+        if not self.viewer_attached():
+            return
+        slot = self.written % self.slots
+        self.versions[slot] += 1
+        np.multiply(np.ravel(observation), 255, out=self.frames[slot], casting="unsafe")
+        self.scores[slot] = 0
+        self.scores[slot, :len(scores)] = scores
+        self.frame_numbers[slot] = frame_number
+        self.versions[slot] += 1
+        self.written += 1
+        self.header[3] = self.written
+
+    def close(self):
+        self.header[4] = 1
+        self._unmap()
+        self.segment.unlink()
+
+
+class FrameReader(_Ring):
+    """Viewer side, attaches to a running FrameBroadcaster by name"""
+
+    def __init__(self, name):
+        segment = SharedSegment(name)
+        width, height, slots = segment.array(0, (3,), np.int64)
+        self._map(segment, int(width), int(height), int(slots))
+        self.heartbeat[0] = time.time()
+
+    def trainer_closed(self):
+        return bool(self.header[4])
+
+    def latest(self):
+        """(frame as a (width, height) uint8 array, scores, frame number) of the newest
+        complete frame, or None if nothing has been published since attaching"""
+        self.heartbeat[0] = time.time()
+        written = int(self.header[3])
+        for back in range(1, min(written, self.slots) + 1):
+            slot = (written - back) % self.slots
+            before = self.versions[slot]
+            frame = self.frames[slot].reshape((self.width, self.height)).copy()
+            scores = self.scores[slot].copy()
+            frame_number = int(self.frame_numbers[slot])
+            if before % 2 == 0 and self.versions[slot] == before:
+                return frame, scores, frame_number
+        return None
+
+    def close(self):
+        """Detach, the trainer stops publishing once the heartbeat goes stale"""
+        self.heartbeat[0] = 0
+        self._unmap()
+
+
+def view(name, scale=6, fps=30):
+    """Draw the newest frame of the run called name until the window is closed"""
+    import pygame
+
+    reader = FrameReader(name)
+    pygame.init()
+    screen = pygame.display.set_mode((reader.width * scale, reader.height * scale))
+    pygame.display.set_caption("Watching {}".format(name))
+    font = pygame.font.Font(None, 24)
+    clock = pygame.time.Clock()
+    last_frame_number = None
+    try:
+        while True:
+            if any(event.type == pygame.QUIT for event in pygame.event.get()):
+                break
+            latest = reader.latest()
+            if latest is not None and latest[2] != last_frame_number:
+                frame, scores, last_frame_number = latest
+                # frames are indexed [x, y] like pygame.surfarray
+                surface = pygame.surfarray.make_surface(np.repeat(frame[:, :, np.newaxis], 3, axis=2))
+                screen.blit(pygame.transform.scale(surface, screen.get_size()), (0, 0))
+                text = "Frame {} | Score {} - {}".format(last_frame_number, scores[0], scores[1])
+                screen.blit(font.render(text, True, (255, 64, 64)), (4, 4))
+                pygame.display.flip()
+            if reader.trainer_closed():
+                pygame.display.set_caption("{} has finished".format(name))
+            clock.tick(fps)
+    finally:
+        reader.close()
+        pygame.quit()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Watch a training run that was started with a view name")
+    parser.add_argument("name")
+    parser.add_argument("--scale", type=int, default=6)
+    parser.add_argument("--fps", type=int, default=30)
+    args = parser.parse_args()
+    view(args.name, args.scale, args.fps)
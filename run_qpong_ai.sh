@@ -1,5 +1,4 @@
 #!/bin/bash
 
-for (( i = 0; i < 100; i++ )); do
-    python3.5 qpong_ai.py
-done
\ No newline at end of file
+# one long run, training checkpoints as it goes so rerunning resumes where it stopped
+python3.5 qpong_ai.py --epochs 10000
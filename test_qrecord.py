@@ -0,0 +1,53 @@
+"""Episodes recorded while training replay to the same result.
+
+Skipped where sge isn't installed, the games run without a window on SDL's dummy video driver.
+"""
+import pytest
+
+from qrecord import EpisodeLog, replay
+from qtrain import TrainConfig
+
+
+@pytest.fixture
+def sge(monkeypatch, tmp_path):
+    monkeypatch.setenv("SDL_VIDEODRIVER", "dummy")
+    monkeypatch.setenv("SDL_AUDIODRIVER", "dummy")
+    # episodes are saved in the working directory
+    monkeypatch.chdir(tmp_path)
+    return pytest.importorskip("sge")
+
+
+def config(**kwargs):
+    return TrainConfig(epoch=2, max_memory=50, batch_size=10, architecture="mlp50", width=40, height=30,
+                       backend="numpy", verbose=False, **kwargs)
+
+
+@pytest.mark.parametrize("seed", [None, 3])
+def test_squash_replay_matches_recording(sge, seed):
+    from qai import SquashLogPlayer
+    from qsquash import Squash
+    from qsquash_ai import train
+
+    train(config(seed=seed), render_every=0, record_episodes=True)
+    for e in range(2):
+        log = EpisodeLog.load("qsquash_ai_episode_{:03d}.json".format(e))
+        assert log.seed is not None
+        if seed is not None:
+            assert log.seed == seed + e
+        result, matches = replay(log, lambda log: Squash(SquashLogPlayer(1, log), log.width, log.height,
+                                                         realtime=False, render_every=0, seed=log.seed))
+        assert matches, "{} != {}".format(result, log.result)
+
+
+def test_pong_replay_matches_recording(sge):
+    from qgame import LogPlayer
+    from qpong import Pong
+    from qpong_ai import train
+
+    train(config(), render_every=0, record_episodes=True)
+    for e in range(2):
+        log = EpisodeLog.load("qpong_ai_episode_{:03d}.json".format(e))
+        assert log.seed is not None
+        result, matches = replay(log, lambda log: Pong(LogPlayer(1, log), LogPlayer(2, log), log.width, log.height,
+                                                       realtime=False, render_every=0, seed=log.seed))
+        assert matches, "{} != {}".format(result, log.result)
@@ -0,0 +1,111 @@
+"""The headless sim against the SGE games it stands in for, and fast_forward against step.
+
+The SGE comparison is skipped where sge isn't installed, it runs without a window
+on SDL's dummy video driver.
+"""
+import os
+import random
+
+import pytest
+
+from qrecord import EpisodeLog
+from qsim import PongSim, SquashSim
+
+FRAMES = 3000
+
+
+def held_actions(num_players, frames, seed):
+    """Random actions per player, each held for a random stretch like a slow player would"""
+    rng = random.Random(seed)
+    players = list()
+    for _ in range(num_players):
+        actions = list()
+        while len(actions) < frames:
+            actions += [rng.choice((-1, 0, 1))] * rng.randint(1, 40)
+        players.append(actions[:frames])
+    return players
+
+
+def state(game):
+    players = [game.player1] if type(game.player2) == int else [game.player1, game.player2]
+    ball = game.ball
+    return (ball.x, ball.y, ball.xvelocity, ball.yvelocity, [p.y for p in players], [p.score for p in players])
+
+
+def play_sim(sim_class, width, height, seed, actions):
+    """state() after every frame of a sim that never ends"""
+    sim = sim_class(width, height, seed=seed)
+    sim.points_to_win = float("inf")
+    states = [state(sim)]
+    for frame in zip(*actions):
+        sim.step(*frame)
+        states.append(state(sim))
+    return states
+
+
+def play_sge(game_name, width, height, seed, actions):
+    """state() at the start of every frame of the SGE game played by LogPlayers"""
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    pytest.importorskip("sge")
+    from qai import SquashLogPlayer
+    from qgame import LogPlayer
+
+    log = EpisodeLog(seed, width, height)
+    log.actions = {n + 1: player_actions for n, player_actions in enumerate(actions)}
+    states = list()
+    if game_name == "pong":
+        from qpong import Pong as base
+        players = (LogPlayer(1, log), LogPlayer(2, log))
+    else:
+        from qsquash import Squash as base
+        players = (SquashLogPlayer(1, log),)
+
+    class Recorded(base):
+        points_to_win = float("inf")
+
+        def event_step(self, time_passed, delta_mult):
+            # before the goal check, what the frames so far left behind
+            states.append(state(self))
+            if len(states) > len(actions[0]):
+                self.end()
+                return
+            super().event_step(time_passed, delta_mult)
+
+    game = Recorded(*players, width, height, realtime=False, render_every=0, seed=seed)
+    game.start()
+    return states
+
+
+@pytest.mark.parametrize("game_name,sim_class,num_players", [("pong", PongSim, 2), ("squash", SquashSim, 1)])
+@pytest.mark.parametrize("width,height", [(80, 60), (160, 120)])
+def test_sim_matches_sge_frame_by_frame(game_name, sim_class, num_players, width, height):
+    for seed in range(3):
+        actions = held_actions(num_players, FRAMES, seed)
+        expected = play_sge(game_name, width, height, seed, actions)
+        for frame, (sim, sge) in enumerate(zip(play_sim(sim_class, width, height, seed, actions), expected)):
+            assert sim == sge, "seed {} frame {}".format(seed, frame)
+        assert len(expected) == FRAMES + 1
+
+
+@pytest.mark.parametrize("sim_class,num_players", [(PongSim, 2), (SquashSim, 1)])
+@pytest.mark.parametrize("width,height", [(40, 30), (80, 60), (100, 75), (160, 120)])
+def test_fast_forward_matches_step(sim_class, num_players, width, height):
+    for seed in range(10):
+        actions = held_actions(num_players, FRAMES, seed)
+        stepped = play_sim(sim_class, width, height, seed, actions)
+        sim = sim_class(width, height, seed=seed)
+        sim.points_to_win = float("inf")
+        jumps = 0
+        while sim.frame_count < FRAMES:
+            frame = [player_actions[sim.frame_count] for player_actions in actions]
+            # as far as every player's action stays the same
+            held = 1
+            while sim.frame_count + held < FRAMES and \
+                    all(a[sim.frame_count + held] == f for a, f in zip(actions, frame)):
+                held += 1
+            advanced, _ = sim.fast_forward(frame, held)
+            jumps += advanced > 1
+            assert 1 <= advanced <= held
+            assert state(sim) == stepped[sim.frame_count], "seed {} frame {}".format(seed, sim.frame_count)
+        assert jumps > 0
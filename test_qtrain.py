@@ -0,0 +1,71 @@
+"""DQN agent settings and state, on the numpy backend so Keras isn't needed."""
+import numpy as np
+import pytest
+
+from qtrain import DQNAgent, ExperienceReplay, NStepReturns, TrainConfig, Trainer
+
+
+def config(**kwargs):
+    settings = dict(architecture="mlp50", width=8, height=6, backend="numpy", seed=0, verbose=False)
+    settings.update(kwargs)
+    return TrainConfig(**settings)
+
+
+def test_double_dqn_needs_a_target_network():
+    with pytest.raises(ValueError):
+        config(double_dqn=True)
+    with pytest.raises(ValueError):
+        config(target_update=100).replace(double_dqn=True, target_update=0)
+    assert DQNAgent(config(double_dqn=True, target_update=100)).target_model is not None
+
+
+def test_state_does_not_change_with_later_transitions():
+    agent = DQNAgent(config(n_step=3))
+    states = [np.full((1, 48), n, dtype=np.float32) for n in range(4)]
+    agent.observe(states[0], 0, 1., states[1], False)
+    agent.observe(states[1], 1, 1., states[2], False)
+    pending = agent.get_state()["pending"]
+    saved = [list(transition) for transition in pending]
+
+    agent.observe(states[2], 2, 1., states[3], False)
+    assert pending == saved
+
+
+def test_weights_file_is_only_loaded_with_resume_weights(tmp_path):
+    weights_file = str(tmp_path / "model.h5")
+    trained = DQNAgent(config(seed=1)).model
+    trained.save_weights(weights_file)
+
+    for resume in (True, False):
+        settings = config(weights_file=weights_file, resume_weights=resume)
+        agent = DQNAgent(settings)
+        Trainer(settings, [agent], None).resume()
+        loaded = all(np.array_equal(a, b) for a, b in zip(agent.model.get_weights(), trained.get_weights()))
+        assert loaded == resume
+
+
+def test_truncated_episode_bootstraps():
+    n_step = NStepReturns(3, discount=.5)
+    assert n_step.add("s0", 0, 1., "s1", False) == []
+    done = n_step.add("s1", 1, 1., "s2", True, truncated=True)
+    # cut short by the time limit, both complete early but still bootstrap from s2
+    assert done == [("s0", 0, 1.5, "s2", False, .25), ("s1", 1, 1., "s2", False, .5)]
+    assert n_step.add("s2", 2, -1., "s3", True) == [("s2", 2, -1., "s3", True, .5)]
+
+
+def test_time_limit_is_not_terminal(monkeypatch):
+    from qenv import PongEnv, train
+
+    replays = list()
+    remember = ExperienceReplay.remember
+
+    def remember_and_keep(replay, *transition):
+        replays.append(replay)
+        remember(replay, *transition)
+
+    monkeypatch.setattr(ExperienceReplay, "remember", remember_and_keep)
+    history = train(config(width=40, height=30, epoch=1, n_step=3), PongEnv(40, 30, seed=0, max_frames=20))
+    assert history[-1]["frames"] == 20
+    memory = replays[-1].memory
+    # every step got into the replay, none of them as the end of the game
+    assert len(memory) == 20 and not any(transition[4] for transition in memory)
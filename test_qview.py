@@ -0,0 +1,25 @@
+"""Trainer and viewer sides of the shared frame ring."""
+import os
+
+import numpy as np
+
+from qtrain import TrainConfig
+from qview import FrameBroadcaster, FrameReader
+
+
+def test_broadcaster_replaces_a_ring_left_by_a_crashed_trainer():
+    config = TrainConfig(view_name="test_qview_{}".format(os.getpid()), width=8, height=6)
+    crashed = FrameBroadcaster.for_config(config)
+    # mapped but never unlinked, like a trainer that died
+    crashed._unmap()
+
+    broadcaster = FrameBroadcaster.for_config(config)
+    try:
+        reader = FrameReader(config.view_name)
+        broadcaster.publish(np.ones(48), [1, 2], 7)
+        frame, scores, frame_number = reader.latest()
+        assert frame.shape == (8, 6) and frame.min() == 255
+        assert list(scores) == [1, 2] and frame_number == 7
+        reader.close()
+    finally:
+        broadcaster.close()